@@ -0,0 +1,679 @@
+#
+# foris-controller-testtools
+# Copyright (C) 2026 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" Benchmarks of the message buses and foris-controller
+
+    python -m foris_controller_testtools.bench notifications --bus mqtt --count 10000
+    python -m foris_controller_testtools.bench load --bus ubus -r about.get --workers 4
+    python -m foris_controller_testtools.bench payloads --bus unix-socket --max-size 10M
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import typing
+import uuid
+
+from . import infrastructure as infra
+from . import perf
+from .resources import ROUTER_PROFILES, sample_process
+from .sandbox import sandbox_path, set_sandbox_root
+
+BENCH_MODULE = "testtools_bench"
+BENCH_ACTION = "flood"
+PAYLOAD_SIZES = (1000, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7, 10 ** 8)
+
+
+class NotificationBenchResult(typing.NamedTuple):
+    bus: str
+    sent: int
+    received: int
+    in_order: bool
+    seconds: float  # from the first send till the last notification was received
+    latency: perf.LatencyHistogram
+
+    @property
+    def throughput(self) -> float:
+        return self.received / self.seconds if self.seconds else 0.0
+
+    @property
+    def loss(self) -> float:
+        return (self.sent - self.received) / self.sent if self.sent else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "bus": self.bus,
+            "sent": self.sent,
+            "received": self.received,
+            "in_order": self.in_order,
+            "seconds": self.seconds,
+            "throughput": self.throughput,
+            "loss": self.loss,
+            "latency": self.latency.to_dict(),
+        }
+
+
+def _read_notifications(infrastructure: infra.Infrastructure) -> typing.List[dict]:
+    """ Reads stored notifications including the listener's metadata """
+    infrastructure.flush_notifications()
+    try:
+        with infra.notifications_lock, open(infra.NOTIFICATIONS_OUTPUT_PATH) as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return []
+    return [json.loads(e) for e in lines if e.endswith("\n")]
+
+
+def notification_flood(
+    infrastructure: infra.Infrastructure,
+    notify: typing.Callable,
+    count: int = 1000,
+    timeout: float = 30.0,
+    module: str = BENCH_MODULE,
+    action: str = BENCH_ACTION,
+) -> NotificationBenchResult:
+    """ Sends notifications as fast as possible and waits till they reach the listener
+
+    :param infrastructure: running infrastructure
+    :param notify: function which sends a notification (see notify_api fixture)
+    :param count: number of notifications to send
+    :param timeout: how long to wait for the notifications which were not received yet
+    :param module: module of the notifications
+    :param action: action of the notifications
+    """
+    run_id = uuid.uuid4().hex
+    sent_times = []
+    start = time.time()
+    for seq in range(count):
+        sent_times.append(time.time())
+        notify(module, action, {"run": run_id, "seq": seq}, validate=False)
+
+    deadline = time.monotonic() + timeout
+    while True:
+        received = [
+            e
+            for e in _read_notifications(infrastructure)
+            if e["module"] == module
+            and e["action"] == action
+            and e.get("data", {}).get("run") == run_id
+        ]
+        if len(received) >= count or time.monotonic() > deadline:
+            break
+        time.sleep(0.05)
+
+    seqs = [e["data"]["seq"] for e in received]
+    latency = perf.LatencyHistogram()
+    last = start
+    for msg in received:
+        stamp = msg.get(infra.NOTIFICATION_META_KEY, {}).get("received")
+        if stamp is not None:
+            latency.add(stamp - sent_times[msg["data"]["seq"]])
+            last = max(last, stamp)
+
+    return NotificationBenchResult(
+        infrastructure.name, count, len(set(seqs)), seqs == sorted(seqs), last - start, latency
+    )
+
+
+class LoadRequest(typing.NamedTuple):
+    module: str
+    action: str
+    data: typing.Optional[dict] = None
+    weight: int = 1  # how many times the request is repeated within the mix
+
+    def message(self) -> dict:
+        res = {"module": self.module, "action": self.action, "kind": "request"}
+        if self.data is not None:
+            res["data"] = self.data
+        return res
+
+
+class LoadResult(typing.NamedTuple):
+    bus: str
+    requests: int
+    errors: int
+    seconds: float
+    latency: perf.LatencyHistogram
+    cpu_seconds: float  # consumed by foris-controller during the run
+    max_rss: int  # of foris-controller (bytes)
+
+    @property
+    def throughput(self) -> float:
+        return self.requests / self.seconds if self.seconds else 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.requests if self.requests else 0.0
+
+    @property
+    def cpu_usage(self) -> float:
+        return self.cpu_seconds / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "bus": self.bus,
+            "requests": self.requests,
+            "errors": self.errors,
+            "seconds": self.seconds,
+            "throughput": self.throughput,
+            "error_rate": self.error_rate,
+            "cpu_seconds": self.cpu_seconds,
+            "cpu_usage": self.cpu_usage,
+            "max_rss": self.max_rss,
+            "latency": self.latency.to_dict(),
+        }
+
+
+def _is_error_reply(reply: dict) -> bool:
+    if not reply or not isinstance(reply, dict):
+        return True  # e.g. mqtt reply timeout
+    return "errors" in reply or "errors" in (reply.get("data") or {})
+
+
+def request_load(
+    infrastructure: infra.Infrastructure,
+    requests: typing.Sequence[LoadRequest],
+    count: typing.Optional[int] = 1000,
+    duration: typing.Optional[float] = None,
+    workers: int = 1,
+    rate: typing.Optional[float] = None,
+    sample_interval: float = 0.1,
+) -> LoadResult:
+    """ Drives requests against the running controller
+
+        Requests are taken from the mix in a round-robin fashion (weighted).
+        When rate is set the requests are issued at that rate (in total),
+        otherwise each worker sends the next request as soon as it gets the reply.
+
+    :param infrastructure: running infrastructure
+    :param requests: request mix
+    :param count: total number of requests (None = unlimited)
+    :param duration: stop issuing requests after this many seconds (None = unlimited)
+    :param workers: number of concurrent workers
+    :param rate: target rate (requests per second)
+    :param sample_interval: how often is the controller's RSS sampled
+    """
+    if count is None and duration is None:
+        raise ValueError("Either count or duration has to be set")
+
+    mix = list(itertools.chain.from_iterable([e.message()] * e.weight for e in requests))
+    latency = perf.LatencyHistogram()
+    lock = threading.Lock()
+    # python ubus bindings use a single global connection
+    bus_lock = threading.Lock() if infrastructure.name == "ubus" else contextlib.nullcontext()
+    counters = {"issued": 0, "errors": 0}
+    finished = threading.Event()
+
+    pid = infrastructure.server.pid
+    initial = sample_process(pid)
+    max_rss = [initial.rss if initial else 0]
+
+    def sampler():
+        while not finished.wait(sample_interval):
+            sample = sample_process(pid)
+            if sample:
+                max_rss[0] = max(max_rss[0], sample.rss)
+
+    infrastructure.wait_ready()
+    start = time.monotonic()
+
+    def worker():
+        while True:
+            with lock:
+                index = counters["issued"]
+                if count is not None and index >= count:
+                    return
+                if duration is not None and time.monotonic() - start >= duration:
+                    return
+                counters["issued"] += 1
+
+            if rate:
+                delay = start + index / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            sent = time.perf_counter()
+            try:
+                with bus_lock:
+                    reply = infrastructure.process_message(mix[index % len(mix)])
+                error = _is_error_reply(reply)
+            except Exception:
+                error = True
+            elapsed = time.perf_counter() - sent
+
+            with lock:
+                latency.add(elapsed)
+                if error:
+                    counters["errors"] += 1
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    sampler_thread = threading.Thread(target=sampler, daemon=True)
+    sampler_thread.start()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.monotonic() - start
+    finished.set()
+    sampler_thread.join()
+
+    final = sample_process(pid)
+    if final:
+        max_rss[0] = max(max_rss[0], final.rss)
+    cpu_seconds = final.cpu_seconds - initial.cpu_seconds if initial and final else 0.0
+
+    return LoadResult(
+        infrastructure.name,
+        latency.count,
+        counters["errors"],
+        seconds,
+        latency,
+        cpu_seconds,
+        max_rss[0],
+    )
+
+
+class PayloadResult(typing.NamedTuple):
+    bus: str
+    size: int  # length of the payload string
+    errors: int  # error replies (e.g. the payload is rejected by the schema)
+    latency: perf.LatencyHistogram
+
+    @property
+    def throughput(self) -> float:
+        """ payload bytes per second """
+        return self.size / self.latency.mean if self.latency.mean else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "bus": self.bus,
+            "size": self.size,
+            "errors": self.errors,
+            "throughput": self.throughput,
+            "latency": self.latency.to_dict(),
+        }
+
+
+def payload_sweep(
+    infrastructure: infra.Infrastructure,
+    module: str,
+    action: str,
+    sizes: typing.Sequence[int] = PAYLOAD_SIZES,
+    repeat: int = 3,
+) -> typing.List[PayloadResult]:
+    """ Sends requests with growing payloads and measures their round trips
+
+        The payload is sent as {"payload": "xxx..."}. Whole message is transferred
+        and parsed even when the module replies with an error, so any action can be used.
+
+    :param infrastructure: running infrastructure
+    :param module: module of the requests
+    :param action: action of the requests
+    :param sizes: payload sizes (characters)
+    :param repeat: number of requests of each size
+    """
+    res = []
+    for size in sizes:
+        message = {"module": module, "action": action, "kind": "request"}
+        message["data"] = {"payload": "x" * size}
+        latency = perf.LatencyHistogram()
+        errors = 0
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                error = _is_error_reply(infrastructure.process_message(message))
+            except Exception:
+                error = True
+            latency.add(time.perf_counter() - start)
+            errors += 1 if error else 0
+        del message
+        res.append(PayloadResult(infrastructure.name, size, errors, latency))
+    return res
+
+
+def bench_check(
+    infrastructure: infra.Infrastructure,
+    notify: typing.Callable,
+    request: LoadRequest,
+    count: int = 20,
+) -> typing.List[str]:
+    """ Runs each benchmark briefly to check that it completes (replies may contain errors)
+
+    :param infrastructure: running infrastructure
+    :param notify: function which sends notifications (see notification_api)
+    :param request: request used by the load and payload benchmarks
+    :param count: number of notifications / requests
+    :returns: problems found (empty when everything completed)
+    """
+    problems = []
+    flood = notification_flood(infrastructure, notify, count, timeout=10.0)
+    if flood.received != flood.sent:
+        problems.append(f"notifications: {flood.received} of {flood.sent} received")
+
+    load = request_load(infrastructure, [request], count)
+    if load.requests != count:
+        problems.append(f"load: {load.requests} of {count} requests sent")
+
+    sizes = PAYLOAD_SIZES[:2]
+    payloads = payload_sweep(infrastructure, request.module, request.action, sizes, repeat=1)
+    if [e.size for e in payloads] != list(sizes):
+        problems.append("payloads: sweep didn't finish")
+    return problems
+
+
+@contextlib.contextmanager
+def spawned_infrastructure(
+    bus: str,
+    backend: str = "mock",
+    modules: typing.Sequence[str] = (),
+    extra_module_paths: typing.Sequence[str] = (),
+    debug_output: bool = False,
+    router_profile: typing.Optional[str] = None,
+):
+    """ Starts foris-controller on the bus outside of pytest (uses empty sandbox directories) """
+    cmdline_script_root = tempfile.mkdtemp(prefix="testtools-bench-")
+    for name in ("UCI_CONFIG_DIR_PATH", "FILE_ROOT_PATH"):
+        os.makedirs(sandbox_path(name), exist_ok=True)
+
+    instance = infra.INFRASTRUCTURE_CLASSES[bus](
+        backend,
+        list(modules),
+        list(extra_module_paths),
+        sandbox_path("UCI_CONFIG_DIR_PATH"),
+        cmdline_script_root,
+        sandbox_path("FILE_ROOT_PATH"),
+        debug_output=debug_output,
+        router_profile=router_profile,
+    )
+    try:
+        instance.wait_ready()
+        yield instance
+    finally:
+        instance.exit()
+        shutil.rmtree(cmdline_script_root, ignore_errors=True)
+
+
+def format_notification_results(results: typing.List[NotificationBenchResult]) -> typing.List[str]:
+    headers = ["bus", "sent", "received", "loss", "in order", "msg/s"]
+    headers += ["p%d (ms)" % e for e in perf.PERCENTILES]
+    rows = []
+    for result in results:
+        rows.append(
+            [
+                result.bus,
+                str(result.sent),
+                str(result.received),
+                "%.2f %%" % (result.loss * 100),
+                "yes" if result.in_order else "no",
+                "%.1f" % result.throughput,
+            ]
+            + ["%.2f" % (result.latency.percentile(e) * 1000) for e in perf.PERCENTILES]
+        )
+    return perf.format_columns(headers, rows)
+
+
+def format_load_results(results: typing.List[LoadResult]) -> typing.List[str]:
+    headers = ["bus", "requests", "errors", "req/s"]
+    headers += ["p%d (ms)" % e for e in perf.PERCENTILES]
+    headers += ["cpu", "max rss (MiB)"]
+    rows = []
+    for result in results:
+        rows.append(
+            [
+                result.bus,
+                str(result.requests),
+                "%d (%.2f %%)" % (result.errors, result.error_rate * 100),
+                "%.1f" % result.throughput,
+            ]
+            + ["%.2f" % (result.latency.percentile(e) * 1000) for e in perf.PERCENTILES]
+            + ["%.1f %%" % (result.cpu_usage * 100), "%.1f" % (result.max_rss / 1024 / 1024)]
+        )
+    return perf.format_columns(headers, rows)
+
+
+def format_payload_results(results: typing.List[PayloadResult]) -> typing.List[str]:
+    headers = ["bus", "size", "errors", "mean (ms)", "max (ms)", "MiB/s"]
+    rows = []
+    for result in results:
+        rows.append(
+            [
+                result.bus,
+                str(result.size),
+                str(result.errors),
+                "%.2f" % (result.latency.mean * 1000),
+                "%.2f" % (result.latency.maximum * 1000),
+                "%.1f" % (result.throughput / 1024 / 1024),
+            ]
+        )
+    return perf.format_columns(headers, rows)
+
+
+def parse_size(value: str) -> int:
+    """ Parses size with an optional K / M / G suffix (decimal) """
+    multipliers = {"K": 10 ** 3, "M": 10 ** 6, "G": 10 ** 9}
+    suffix = value[-1:].upper()
+    if suffix in multipliers:
+        return int(float(value[:-1]) * multipliers[suffix])
+    return int(value)
+
+
+def parse_load_request(value: str) -> LoadRequest:
+    """ Parses request mix item from command line: module.action[*weight][=json data]
+
+        e.g. `about.get`, `web.get_data*3`, `time.update_settings={"region": "Europe"}`
+    """
+    spec, _, data = value.partition("=")
+    spec, _, weight = spec.partition("*")
+    module, _, action = spec.partition(".")
+    if not module or not action:
+        raise argparse.ArgumentTypeError(f"'{value}' doesn't match module.action[*weight][=data]")
+    return LoadRequest(module, action, json.loads(data) if data else None, int(weight or 1))
+
+
+def _add_common_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--bus",
+        nargs="+",
+        choices=sorted(infra.INFRASTRUCTURE_CLASSES),
+        default=sorted(infra.INFRASTRUCTURE_CLASSES),
+        help="message buses to benchmark",
+    )
+    parser.add_argument("--backend", choices=["mock", "openwrt"], default="mock")
+    parser.add_argument("-m", "--module", dest="modules", action="append", default=[])
+    parser.add_argument(
+        "--extra-module-path", dest="extra_module_paths", action="append", default=[]
+    )
+    parser.add_argument("--sandbox-root", help="directory for the mutable state of the run")
+    parser.add_argument("--router-profile", choices=sorted(ROUTER_PROFILES))
+    parser.add_argument("--debug-output", action="store_true", default=False)
+    parser.add_argument("--json", dest="json_path", help="write the results to a JSON file")
+
+
+def _run_notifications(options: argparse.Namespace) -> typing.List[dict]:
+    results = []
+    for bus in options.bus:
+        with spawned_infrastructure(
+            bus,
+            options.backend,
+            options.modules,
+            options.extra_module_paths,
+            options.debug_output,
+            options.router_profile,
+        ) as instance:
+            with infra.notification_api(instance, options.extra_module_paths) as notify:
+                results.append(notification_flood(instance, notify, options.count, options.timeout))
+
+    for line in format_notification_results(results):
+        print(line)
+    return [e.to_dict() for e in results]
+
+
+def _run_load(options: argparse.Namespace) -> typing.List[dict]:
+    requests = list(options.requests)
+    if options.request_file:
+        with open(options.request_file) as f:
+            requests.extend(LoadRequest(**e) for e in json.load(f))
+    if not requests:
+        raise SystemExit("No requests to send (use --request or --request-file)")
+
+    results = []
+    for bus in options.bus:
+        with spawned_infrastructure(
+            bus,
+            options.backend,
+            options.modules,
+            options.extra_module_paths,
+            options.debug_output,
+            options.router_profile,
+        ) as instance:
+            results.append(
+                request_load(
+                    instance,
+                    requests,
+                    options.count,
+                    options.duration,
+                    options.workers,
+                    options.rate,
+                )
+            )
+
+    for line in format_load_results(results):
+        print(line)
+    return [e.to_dict() for e in results]
+
+
+def _run_payloads(options: argparse.Namespace) -> typing.List[dict]:
+    sizes = [e for e in PAYLOAD_SIZES if options.min_size <= e <= options.max_size]
+    module, _, action = options.request.partition(".")
+    results = []
+    for bus in options.bus:
+        with spawned_infrastructure(
+            bus,
+            options.backend,
+            options.modules,
+            options.extra_module_paths,
+            options.debug_output,
+            options.router_profile,
+        ) as instance:
+            results.extend(payload_sweep(instance, module, action, sizes, options.repeat))
+
+    for line in format_payload_results(results):
+        print(line)
+    return [e.to_dict() for e in results]
+
+
+def _run_check(options: argparse.Namespace) -> typing.List[dict]:
+    results = []
+    for bus in options.bus:
+        try:
+            with spawned_infrastructure(
+                bus,
+                options.backend,
+                options.modules,
+                options.extra_module_paths,
+                options.debug_output,
+                options.router_profile,
+            ) as instance:
+                with infra.notification_api(instance, options.extra_module_paths) as notify:
+                    problems = bench_check(instance, notify, options.request, options.count)
+        except Exception as exc:
+            problems = [f"{type(exc).__name__}: {exc}"]
+        results.append({"bus": bus, "problems": problems})
+        print("%s: %s" % (bus, "; ".join(problems) if problems else "ok"))
+    return results
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m foris_controller_testtools.bench")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    notifications = subparsers.add_parser(
+        "notifications", help="flood the bus with notifications and measure their delivery"
+    )
+    _add_common_arguments(notifications)
+    notifications.add_argument("--count", type=int, default=1000)
+    notifications.add_argument("--timeout", type=float, default=30.0)
+    notifications.set_defaults(run=_run_notifications)
+
+    load = subparsers.add_parser("load", help="drive a request mix against foris-controller")
+    _add_common_arguments(load)
+    load.add_argument(
+        "-r",
+        "--request",
+        dest="requests",
+        action="append",
+        type=parse_load_request,
+        default=[],
+        help="request of the mix: module.action[*weight][=json data]",
+    )
+    load.add_argument(
+        "--request-file", help="JSON list of {module, action, data, weight} objects"
+    )
+    load.add_argument("--count", type=int, help="total number of requests")
+    load.add_argument("--duration", type=float, help="how long to issue requests (seconds)")
+    load.add_argument("--workers", type=int, default=1, help="number of concurrent workers")
+    load.add_argument("--rate", type=float, help="target rate (requests per second)")
+    load.set_defaults(run=_run_load)
+
+    payloads = subparsers.add_parser(
+        "payloads", help="measure round trips of requests with growing payloads"
+    )
+    _add_common_arguments(payloads)
+    payloads.add_argument(
+        "-r", "--request", default="echo.echo", help="module.action the payloads are sent to"
+    )
+    payloads.add_argument("--min-size", type=parse_size, default=PAYLOAD_SIZES[0])
+    payloads.add_argument("--max-size", type=parse_size, default=PAYLOAD_SIZES[-1])
+    payloads.add_argument("--repeat", type=int, default=3, help="requests of each size")
+    payloads.set_defaults(run=_run_payloads)
+
+    check = subparsers.add_parser(
+        "check", help="run each benchmark briefly and fail unless all of them complete"
+    )
+    _add_common_arguments(check)
+    check.set_defaults(bus=["unix-socket"])
+    check.add_argument(
+        "-r", "--request", type=parse_load_request, default=parse_load_request("echo.echo")
+    )
+    check.add_argument("--count", type=int, default=20)
+    check.set_defaults(run=_run_check)
+
+    options = parser.parse_args(argv)
+    if options.command == "load" and options.count is None and options.duration is None:
+        options.count = 1000
+    if options.sandbox_root:
+        set_sandbox_root(options.sandbox_root)
+
+    results = options.run(options)
+    if options.json_path:
+        perf.write_report(options.json_path, {options.command: results})
+    if options.command == "check" and any(e["problems"] for e in results):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+#
+# foris-controller-testtools
+# Copyright (C) 2026 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+import os
+import shutil
+import stat
+import tempfile
+import typing
+
+from . import utils
+from .sandbox import get_sandbox_root
+
+# relative path -> (kind, size, mtime_ns, mode) where kind is "d", "f" or "l"
+Manifest = typing.Dict[str, typing.Tuple[str, int, int, int]]
+
+
+def _remove(path: str):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def _scan(path: str) -> typing.Optional[Manifest]:
+    """ Lists path content (the path itself is stored as ".") """
+
+    def describe(st: os.stat_result) -> typing.Tuple[str, int, int, int]:
+        if stat.S_ISLNK(st.st_mode):
+            return "l", 0, 0, 0
+        if stat.S_ISDIR(st.st_mode):
+            return "d", 0, 0, stat.S_IMODE(st.st_mode)
+        return "f", st.st_size, st.st_mtime_ns, stat.S_IMODE(st.st_mode)
+
+    try:
+        root_stat = os.lstat(path)
+    except FileNotFoundError:
+        return None
+
+    res = {".": describe(root_stat)}
+    if res["."][0] != "d":
+        return res
+
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        with os.scandir(os.path.join(path, rel_dir)) as entries:
+            for entry in entries:
+                rel = os.path.join(rel_dir, entry.name)
+                res[rel] = describe(entry.stat(follow_symlinks=False))
+                if res[rel][0] == "d":
+                    stack.append(rel)
+    return res
+
+
+class _Entry:
+    def __init__(self, key: typing.Hashable, store: str, manifest: typing.Optional[Manifest]):
+        self.key = key
+        self.snapshot_path = os.path.join(store, "snapshot")
+        self.parked_path = os.path.join(store, "parked")
+        self.manifest = manifest
+
+
+class NullCheckpoint:
+    """ Same interface as SandboxCheckpoint, but the paths are always recreated from scratch """
+
+    def restore(self, path: str, key: typing.Hashable, populate: typing.Callable[[], None]):
+        _remove(path)
+        populate()
+
+    def park(self, path: str):
+        _remove(path)
+
+    def close(self):
+        pass
+
+
+class SandboxCheckpoint:
+    """ Keeps pristine copies of prepared sandbox paths
+
+        The first restore() of a path runs populate callback and captures the result.
+        Following restore() calls with the same key only fix files which differ
+        from the captured state (size, mtime, mode or kind).
+    """
+
+    def __init__(self, store_dir: typing.Optional[str] = None):
+        if store_dir is None:
+            store_dir = tempfile.mkdtemp(prefix=".testtools-checkpoint-", dir=get_sandbox_root())
+        self.store_dir = store_dir
+        self._entries: typing.Dict[str, _Entry] = {}
+        self.captures = 0
+        self.restored_files = 0
+        self.removed_paths = 0
+
+    def restore(self, path: str, key: typing.Hashable, populate: typing.Callable[[], None]):
+        """ Makes path look like right after populate() was called
+
+        :param path: live path within the sandbox
+        :param key: identifies the content populate() creates (e.g. source directory)
+        :param populate: fills the (already removed) path with the desired content
+        """
+        path = os.path.normpath(path)
+        entry = self._entries.get(path)
+        if entry is not None and entry.key == key:
+            self._unpark(path, entry)
+            self._restore(path, entry)
+            return
+
+        self.discard(path)
+        _remove(path)
+        populate()
+        self._capture(path, key)
+
+    def park(self, path: str):
+        """ Moves the live path out of the sandbox (cheap replacement of removal)
+
+            Next restore() of the path moves it back and fixes the differences.
+        """
+        path = os.path.normpath(path)
+        entry = self._entries.get(path)
+        if entry is None:
+            _remove(path)
+            return
+
+        _remove(entry.parked_path)
+        if os.path.lexists(path):
+            try:
+                os.rename(path, entry.parked_path)
+            except OSError:
+                _remove(path)
+
+    def discard(self, path: str):
+        entry = self._entries.pop(os.path.normpath(path), None)
+        if entry is not None:
+            shutil.rmtree(os.path.dirname(entry.snapshot_path), ignore_errors=True)
+
+    def close(self):
+        """ Removes the live paths and all the stored copies """
+        for path in list(self._entries):
+            _remove(path)
+            self.discard(path)
+        shutil.rmtree(self.store_dir, ignore_errors=True)
+
+    def _capture(self, path: str, key: typing.Hashable):
+        entry = _Entry(key, tempfile.mkdtemp(dir=self.store_dir), _scan(path))
+        if entry.manifest is not None:
+            if entry.manifest["."][0] == "d":
+                utils.copy_tree(path, entry.snapshot_path, symlinks=True)
+            elif entry.manifest["."][0] == "l":
+                os.symlink(os.readlink(path), entry.snapshot_path)
+            else:
+                utils.copy_file_pairs([(path, entry.snapshot_path)])
+        self._entries[path] = entry
+        self.captures += 1
+
+    def _unpark(self, path: str, entry: _Entry):
+        if not os.path.lexists(entry.parked_path):
+            return
+        if os.path.lexists(path):
+            _remove(entry.parked_path)
+        else:
+            os.rename(entry.parked_path, path)
+
+    def _restore(self, path: str, entry: _Entry):
+        expected = entry.manifest
+        current = _scan(path)
+
+        if expected is None or current is None or current["."][0] != expected["."][0]:
+            if current is not None:
+                _remove(path)
+                self.removed_paths += 1
+            current = {}
+
+        if expected is None:
+            return
+
+        # drop extra paths (shortest first so the content of removed directories is skipped)
+        removed: typing.List[str] = []
+        for rel in sorted(current, key=len):
+            if rel in expected and expected[rel][0] == current[rel][0]:
+                continue
+            if any(rel.startswith(e + os.sep) for e in removed):
+                continue
+            _remove(os.path.join(path, rel))
+            removed.append(rel)
+            self.removed_paths += 1
+
+        pairs = []
+        for rel in sorted(expected, key=len):
+            info = expected[rel]
+            target = os.path.normpath(os.path.join(path, rel))
+            source = os.path.normpath(os.path.join(entry.snapshot_path, rel))
+            present = current.get(rel) if rel not in removed else None
+            if info[0] == "d":
+                if present is None:
+                    os.makedirs(target, exist_ok=True)
+                if present is None or present[3] != info[3]:
+                    os.chmod(target, info[3])
+            elif info[0] == "l":
+                if present is None:
+                    os.symlink(os.readlink(source), target)
+            elif present != info:
+                pairs.append((source, target))
+
+        if pairs:
+            utils.copy_file_pairs(pairs)
+            self.restored_files += len(pairs)
@@ -0,0 +1,657 @@
+#
+# foris-controller-testtools
+# Copyright (C) 2026 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+import abc
+import json
+import os
+import random
+import shlex
+import shutil
+import socket
+import socketserver
+import struct
+import sys
+import textwrap
+import threading
+import time
+import typing
+
+from collections import defaultdict
+
+from .sandbox import sandbox_path
+
+CALLS_LOG_PATH = sandbox_path("CALLS_LOG_PATH")
+COLLECTOR_SOCK_PATH = "/tmp/foris-controller-testtools-commands.soc"
+SHIM_REPLY_TIMEOUT = 5  # seconds a shim waits for the collector's reply
+SHIM_ERROR_RETCODE = 70  # exit code of a shim which didn't get a valid reply (EX_SOFTWARE)
+
+# environment variables stored together with each call
+RECORDED_ENV = ("FORIS_CMDLINE_ROOT", "FORIS_FILE_ROOT", "DEFAULT_UCI_CONFIG_DIR")
+
+# Each call is appended to the log as a sequence of NUL terminated fields:
+# marker, command, pid, timestamp, cwd, env count, env items ("NAME=value"), argc, argv items
+# printf may split a long record into several writes, so the log is locked (when flock exists)
+RECORD_MARKER = "--testtools-call--"
+RECORDED_COMMAND_TEMPLATE = """\
+#!/bin/sh
+echo $@ >> %(path)s
+{
+    command -v flock > /dev/null && flock 9
+    printf '%%s\\0' %(marker)s %(command)s "$$" "$(date +%%s.%%N)" "$PWD" %(env)s "$#" "$@" >&9
+} 9>> %(log)s
+%(delay)s
+exit 0
+"""
+
+
+class LatencyProfile(metaclass=abc.ABCMeta):
+    """ Emulated duration of a faked command """
+
+    @abc.abstractmethod
+    def sample(self, argv: typing.Sequence[str]) -> float:
+        """ Returns the delay (in seconds) of a call with given arguments """
+
+    @abc.abstractmethod
+    def shell(self) -> str:
+        """ Returns sh code which sleeps for the delay (arguments of the call are in "$@") """
+
+
+class FixedLatency(LatencyProfile):
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def sample(self, argv: typing.Sequence[str]) -> float:
+        return self.seconds
+
+    def shell(self) -> str:
+        return "sleep %f" % self.seconds
+
+
+class _AwkLatency(LatencyProfile):
+    awk_expression = ""
+
+    def shell(self) -> str:
+        program = "BEGIN { srand(seed); d = %s; printf \"%%f\", d }" % self.awk_expression
+        return "sleep \"$(awk -v seed=\"$$\" '%s')\"" % program
+
+
+class UniformLatency(_AwkLatency):
+    def __init__(self, low: float, high: float):
+        self.low = low
+        self.high = high
+        self.awk_expression = "%f + %f * rand()" % (low, high - low)
+
+    def sample(self, argv: typing.Sequence[str]) -> float:
+        return random.uniform(self.low, self.high)
+
+
+class NormalLatency(_AwkLatency):
+    def __init__(self, mean: float, stddev: float, minimum: float = 0.0):
+        self.mean = mean
+        self.stddev = stddev
+        self.minimum = minimum
+        # Box-Muller transform
+        gauss = "%f + %f * sqrt(-2 * log(1 - rand())) * cos(6.283185307 * rand())" % (
+            mean,
+            stddev,
+        )
+        self.awk_expression = "%s; if (d < %f) d = %f" % (gauss, minimum, minimum)
+
+    def sample(self, argv: typing.Sequence[str]) -> float:
+        return max(self.minimum, random.gauss(self.mean, self.stddev))
+
+
+class ArgvLatency(LatencyProfile):
+    """ Selects the profile according to the arguments of the call
+
+        e.g. ArgvLatency({("restart",): FixedLatency(0.5)}, default=FixedLatency(0.05))
+    """
+
+    def __init__(
+        self,
+        rules: typing.Dict[typing.Tuple[str, ...], LatencyProfile],
+        default: typing.Optional[LatencyProfile] = None,
+    ):
+        self.rules = rules
+        self.default = default
+
+    def sample(self, argv: typing.Sequence[str]) -> float:
+        for argv_prefix, profile in self.rules.items():
+            if tuple(argv[: len(argv_prefix)]) == tuple(argv_prefix):
+                return profile.sample(argv)
+        return self.default.sample(argv) if self.default else 0.0
+
+    def shell(self) -> str:
+        # arguments are compared one by one (as in sample()), an empty prefix matches all calls
+        lines = []
+        for argv_prefix, profile in self.rules.items():
+            tests = ['[ "$#" -ge %d ]' % len(argv_prefix)] + [
+                '[ "${%d}" = %s ]' % (i, shlex.quote(e)) for i, e in enumerate(argv_prefix, 1)
+            ]
+            lines.append("%s %s; then" % ("elif" if lines else "if", " && ".join(tests)))
+            lines.append(textwrap.indent(profile.shell(), "    "))
+        default = self.default.shell() if self.default else ":"
+        if not lines:
+            return default
+        lines.extend(["else", textwrap.indent(default, "    "), "fi"])
+        return "\n".join(lines)
+
+
+def _env_fields() -> str:
+    """ printf arguments with the environment part of a record """
+    return " ".join(
+        [str(len(RECORDED_ENV))] + ['"%s=${%s-}"' % (name, name) for name in RECORDED_ENV]
+    )
+
+
+def recorded_command_content(
+    command: str,
+    called_file: str,
+    log_path: typing.Optional[str] = None,
+    latency: typing.Optional[LatencyProfile] = None,
+) -> str:
+    """ Content of a fake command which records its calls
+
+        The calls are written both to `called_file` (compatible with *_was_called functions)
+        and as structured records to the calls log (see CommandRecorder).
+
+    :param command: path of the faked command (e.g. /usr/bin/maintain-reboot)
+    :param called_file: file where the arguments are echoed
+    :param log_path: structured calls log (CALLS_LOG_PATH by default)
+    :param latency: how long the command should take after the call is recorded
+    """
+    return RECORDED_COMMAND_TEMPLATE % dict(
+        path=called_file,
+        marker=RECORD_MARKER,
+        command=shlex.quote(command),
+        env=_env_fields(),
+        log=shlex.quote(log_path or CALLS_LOG_PATH),
+        delay=latency.shell() if latency else "",
+    )
+
+
+# The shim sends its call to the collector and prints / returns whatever the collector replies.
+# Messages are prefixed by their length (the same framing as unix-socket bus uses).
+SHIM_COMMAND_TEMPLATE = """\
+#!%(python)s -IS
+import json, os, socket, struct, sys, time
+
+call = {
+    "command": %(command)r,
+    "argv": sys.argv[1:],
+    "cwd": os.getcwd(),
+    "env": {name: os.environ.get(name, "") for name in %(env)r},
+    "timestamp": time.time(),
+    "pid": os.getpid(),
+    "called_file": %(path)r,
+}
+try:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(%(socket_path)r)
+except OSError:
+    # collector is not running, just record the call
+    with open(call["called_file"], "a") as f:
+        f.write(" ".join(call["argv"]) + "\\n")
+    sys.exit(0)
+
+try:
+    data = json.dumps(call).encode("utf8")
+    sock.sendall(struct.pack("I", len(data)) + data)
+    sock.settimeout(%(timeout)d)
+    length = struct.unpack("I", sock.recv(4, socket.MSG_WAITALL))[0]
+    reply = json.loads(sock.recv(length, socket.MSG_WAITALL).decode("utf8"))
+except (OSError, ValueError, struct.error) as exc:
+    sys.stderr.write("testtools shim: no valid reply from the collector (%%s)\\n" %% exc)
+    sys.exit(%(error_retcode)d)
+
+time.sleep(reply["delay"])
+sys.stdout.write(reply["stdout"])
+sys.stderr.write(reply["stderr"])
+sys.exit(reply["retcode"])
+"""
+
+
+# The same shim written in sh (a call costs a few ms instead of ~35 ms of a python start).
+# The call is sent as a record of the calls log prefixed by the called file,
+# the collector replies with sh variable assignments.
+# socat fails only when it can't connect, an empty reply means that the collector didn't answer.
+SH_SHIM_COMMAND_TEMPLATE = """\
+#!/bin/sh
+if ! reply="$(printf '%%s\\0' %(marker)s %(path)s %(command)s "$$" "$(date +%%s.%%N)" "$PWD" \\
+    %(env)s "$#" "$@" | %(socat)s -t %(timeout)d - UNIX-CONNECT:%(socket_path)s 2> /dev/null)"
+then
+    # collector is not running, just record the call
+    echo $@ >> %(path)s
+    exit 0
+fi
+if [ -z "$reply" ]; then
+    echo "testtools shim: no reply from the collector" >&2
+    exit %(error_retcode)d
+fi
+eval "$reply"
+sleep "$delay"
+printf '%%s' "$stdout"
+printf '%%s' "$stderr" >&2
+exit "$retcode"
+"""
+
+
+def shim_command_content(
+    command: str, called_file: str, socket_path: typing.Optional[str] = None
+) -> str:
+    """ Content of a fake command which sends its calls to CommandCollector
+
+        The shim is a sh script when socat is available, python script otherwise
+        (see shim_kind()).
+
+    :param command: path of the faked command (e.g. /usr/bin/maintain-reboot)
+    :param called_file: file where the collector echoes the arguments
+    :param socket_path: collector socket (COLLECTOR_SOCK_PATH by default)
+    """
+    socat = shutil.which("socat")
+    if socat:
+        return SH_SHIM_COMMAND_TEMPLATE % dict(
+            marker=RECORD_MARKER,
+            path=shlex.quote(called_file),
+            command=shlex.quote(command),
+            env=_env_fields(),
+            socat=shlex.quote(socat),
+            socket_path=shlex.quote(socket_path or COLLECTOR_SOCK_PATH),
+            timeout=SHIM_REPLY_TIMEOUT,
+            error_retcode=SHIM_ERROR_RETCODE,
+        )
+
+    return SHIM_COMMAND_TEMPLATE % dict(
+        python=sys.executable,
+        command=command,
+        env=RECORDED_ENV,
+        path=called_file,
+        socket_path=socket_path or COLLECTOR_SOCK_PATH,
+        timeout=SHIM_REPLY_TIMEOUT,
+        error_retcode=SHIM_ERROR_RETCODE,
+    )
+
+
+def shim_kind() -> str:
+    """ Which shims shim_command_content() writes on this host ("sh" or "python") """
+    return "sh" if shutil.which("socat") else "python"
+
+
+def _shim_error(message: str) -> dict:
+    """ Reply which makes the shim fail with the message """
+    return {
+        "delay": 0.0,
+        "retcode": SHIM_ERROR_RETCODE,
+        "stdout": "",
+        "stderr": f"testtools shim: {message}\n",
+    }
+
+
+class CommandCall(typing.NamedTuple):
+    command: str
+    argv: typing.Tuple[str, ...]
+    cwd: str
+    env: typing.Dict[str, str]
+    timestamp: float
+    pid: int
+
+    def latency(self, since: float) -> float:
+        """ Seconds between `since` (e.g. time when the request was sent) and the call """
+        return self.timestamp - since
+
+    def matches(self, argv_prefix: typing.Sequence[str]) -> bool:
+        return tuple(self.argv[: len(argv_prefix)]) == tuple(argv_prefix)
+
+
+def _next_record(fields: typing.List[bytes], pos: int) -> int:
+    try:
+        return fields.index(_RECORD_MARKER, pos)
+    except ValueError:
+        return len(fields)
+
+
+_RECORD_MARKER = RECORD_MARKER.encode()
+
+
+def _parse_records(
+    fields: typing.List[bytes],
+) -> typing.Tuple[typing.List[CommandCall], int, int]:
+    """ Parses complete records from NUL separated fields
+
+        Malformed records (e.g. mixed writes of concurrent calls) are skipped.
+
+    :returns: parsed calls, number of consumed fields and number of skipped records
+    """
+    res = []
+    malformed = 0
+    pos = 0
+    while pos < len(fields):
+        if fields[pos] != _RECORD_MARKER:
+            malformed += 1
+            pos = _next_record(fields, pos)
+            continue
+
+        # a complete record can't contain another marker
+        next_pos = _next_record(fields, pos + 1)
+        try:
+            if pos + 6 > next_pos:
+                raise IndexError
+            env_count = int(fields[pos + 5])
+            argc_pos = pos + 6 + env_count
+            if argc_pos >= next_pos:
+                raise IndexError
+            argc = int(fields[argc_pos])
+            end = argc_pos + 1 + argc
+            if end > next_pos:
+                raise IndexError
+        except IndexError:
+            if next_pos == len(fields):
+                break  # the record is not complete yet
+            malformed += 1
+            pos = next_pos
+            continue
+        except ValueError:
+            malformed += 1
+            pos = next_pos
+            continue
+
+        decoded = [e.decode("utf8", errors="surrogateescape") for e in fields[pos + 1 : end]]
+        try:
+            timestamp = float(decoded[2])
+        except ValueError:
+            timestamp = time.time()  # date without %N support
+        try:
+            call = CommandCall(
+                command=decoded[0],
+                argv=tuple(decoded[argc_pos - pos :]),
+                cwd=decoded[3],
+                env=dict(e.split("=", 1) for e in decoded[5 : argc_pos - pos - 1]),
+                timestamp=timestamp,
+                pid=int(decoded[1]),
+            )
+        except ValueError:
+            malformed += 1
+        else:
+            res.append(call)
+        pos = end
+
+    return res, pos, malformed
+
+
+class CommandRecorder:
+    """ Reads the calls log incrementally and indexes the calls by command
+
+        Commands can be queried by their full path (/usr/bin/maintain-reboot)
+        or by their name (maintain-reboot).
+    """
+
+    def __init__(self, log_path: typing.Optional[str] = None):
+        self.log_path = log_path or CALLS_LOG_PATH
+        self.lock = threading.Lock()
+        self.reference_time: typing.Optional[float] = None
+        self._reset()
+
+    def _reset(self):
+        self.malformed = 0  # records which couldn't be parsed (they are skipped)
+        self._offset = 0
+        self._pending = b""
+        self._calls: typing.List[CommandCall] = []
+        self._index: typing.Dict[str, typing.List[CommandCall]] = defaultdict(list)
+
+    def clear(self):
+        """ Truncates the log and forgets all recorded calls """
+        with self.lock:
+            with open(self.log_path, "wb"):
+                pass
+            self._reset()
+
+    def add(self, call: CommandCall):
+        self._calls.append(call)
+        self._index[call.command].append(call)
+        name = os.path.basename(call.command)
+        if name != call.command:
+            self._index[name].append(call)
+
+    def refresh(self):
+        """ Loads calls which were appended to the log since the last refresh """
+        with self.lock:
+            try:
+                with open(self.log_path, "rb") as f:
+                    f.seek(self._offset)
+                    data = f.read()
+            except FileNotFoundError:
+                return
+            self._offset += len(data)
+
+            fields = (self._pending + data).split(b"\0")
+            complete = fields[:-1]  # the last field is not terminated yet
+            calls, consumed, malformed = _parse_records(complete)
+            self.malformed += malformed
+            self._pending = b"\0".join(fields[consumed:])
+            for call in calls:
+                self.add(call)
+
+    def calls(
+        self, command: typing.Optional[str] = None, argv_prefix: typing.Sequence[str] = ()
+    ) -> typing.List[CommandCall]:
+        """ Lists recorded calls
+
+        :param command: path or name of the command (all commands when None)
+        :param argv_prefix: only calls which arguments start with these
+        """
+        self.refresh()
+        calls = self._calls if command is None else self._index.get(command, [])
+        return [e for e in calls if e.matches(argv_prefix)]
+
+    def mark(self) -> float:
+        """ Sets reference time (e.g. right before a request is sent) and returns it """
+        self.reference_time = time.time()
+        return self.reference_time
+
+    def wait_for_call(
+        self,
+        command: str,
+        argv_prefix: typing.Sequence[str] = (),
+        timeout: float = 5.0,
+        since: typing.Optional[float] = None,
+    ) -> typing.Optional[CommandCall]:
+        """ Waits till the command is called
+
+        :param command: path or name of the command
+        :param argv_prefix: arguments the call should start with
+        :param timeout: how long to wait (in seconds)
+        :param since: ignore calls older than this (reference time set by mark() by default)
+        :returns: the first matching call or None on timeout
+        """
+        since = self.reference_time if since is None else since
+        deadline = time.monotonic() + timeout
+        while True:
+            for call in self.calls(command, argv_prefix):
+                if since is None or call.timestamp >= since:
+                    return call
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(0.05)
+
+    def latency(self, call: CommandCall, since: typing.Optional[float] = None) -> float:
+        """ Seconds between reference time (see mark()) and the call """
+        return call.latency(self.reference_time if since is None else since)
+
+
+class CommandResponse(typing.NamedTuple):
+    retcode: int = 0
+    stdout: str = ""
+    stderr: str = ""
+
+
+class CommandCollector:
+    """ Receives calls of the shim commands over a unix socket
+
+        Calls are recorded to an in-memory CommandRecorder and their arguments are echoed
+        to the called file of the command. Writes are serialized, so the records are not
+        mixed when commands are called concurrently. The reply (exit code and output)
+        of the shim can be programmed via respond().
+    """
+
+    def __init__(self, socket_path: typing.Optional[str] = None):
+        self.socket_path = socket_path or COLLECTOR_SOCK_PATH
+        self.recorder = CommandRecorder()
+        self.lock = threading.Lock()
+        self._responses: typing.List[
+            typing.Tuple[str, typing.Tuple[str, ...], CommandResponse]
+        ] = []
+        self._latencies: typing.Dict[str, LatencyProfile] = {}
+        self.server = None
+        self.thread = None
+
+    def respond(
+        self,
+        command: str,
+        retcode: int = 0,
+        stdout: str = "",
+        stderr: str = "",
+        argv_prefix: typing.Sequence[str] = (),
+    ):
+        """ Sets what the command returns (the most recently set matching response wins)
+
+        :param command: path or name of the command
+        :param retcode: exit code
+        :param stdout: data written to stdout
+        :param stderr: data written to stderr
+        :param argv_prefix: use the response only when arguments start with these
+        """
+        with self.lock:
+            self._responses.append(
+                (command, tuple(argv_prefix), CommandResponse(retcode, stdout, stderr))
+            )
+
+    def set_latency(self, command: str, latency: typing.Optional[LatencyProfile]):
+        """ Sets how long the calls of the command take (None to remove)
+
+        :param command: path or name of the command
+        """
+        with self.lock:
+            if latency is None:
+                self._latencies.pop(command, None)
+            else:
+                self._latencies[command] = latency
+
+    def reset_responses(self):
+        """ Forgets programmed responses and latencies """
+        with self.lock:
+            self._responses = []
+            self._latencies = {}
+
+    def delay_for(self, call: CommandCall) -> float:
+        with self.lock:
+            latency = self._latencies.get(
+                call.command, self._latencies.get(os.path.basename(call.command))
+            )
+        return latency.sample(call.argv) if latency else 0.0
+
+    def response_for(self, call: CommandCall) -> CommandResponse:
+        with self.lock:
+            for command, argv_prefix, response in reversed(self._responses):
+                if command in (call.command, os.path.basename(call.command)) and call.matches(
+                    argv_prefix
+                ):
+                    return response
+        return CommandResponse()
+
+    def handle_call(self, data: dict) -> dict:
+        call = CommandCall(
+            command=data["command"],
+            argv=tuple(data["argv"]),
+            cwd=data["cwd"],
+            env=data["env"],
+            timestamp=data["timestamp"],
+            pid=data["pid"],
+        )
+        with self.lock:
+            self.recorder.add(call)
+            with open(data["called_file"], "a") as f:
+                f.write(" ".join(call.argv) + "\n")
+
+        reply = self.response_for(call)._asdict()
+        reply["delay"] = self.delay_for(call)
+        return reply
+
+    def start(self):
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+        collector = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                length_raw = self.rfile.read(4)
+                if len(length_raw) != 4:
+                    return
+                if length_raw == _RECORD_MARKER[:4]:
+                    self.handle_sh(length_raw + self.rfile.read())
+                    return
+                length = struct.unpack("I", length_raw)[0]
+                try:
+                    reply = collector.handle_call(
+                        json.loads(self.rfile.read(length).decode("utf8"))
+                    )
+                except Exception as exc:
+                    reply = _shim_error(f"collector failed to handle the call ({exc})")
+                data = json.dumps(reply).encode("utf8")
+                self.wfile.write(struct.pack("I", len(data)) + data)
+
+            def handle_sh(self, data: bytes):
+                # marker, called file, record of the calls log
+                # (the shim takes an empty reply for a collector which didn't answer)
+                fields = data.split(b"\0")[:-1]
+                calls, _, _ = _parse_records(fields[:1] + fields[2:])
+                if len(fields) < 2 or not calls:
+                    reply = _shim_error("malformed call record")
+                else:
+                    call = calls[0]._asdict()
+                    call["called_file"] = fields[1].decode("utf8", errors="surrogateescape")
+                    try:
+                        reply = collector.handle_call(call)
+                    except Exception as exc:
+                        reply = _shim_error(f"collector failed to handle the call ({exc})")
+                self.wfile.write(
+                    "".join(
+                        "%s=%s\n" % (name, shlex.quote(str(reply[name])))
+                        for name in ("delay", "retcode", "stdout", "stderr")
+                    ).encode("utf8")
+                )
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        self.server = Server(self.socket_path, Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
@@ -6,3 +6,9 @@ class BackendNotImplementedError(ForisControllerTesttoolsError):
 
 class MockNotFoundError(ForisControllerTesttoolsError):
     pass
+
+class NotifierError(ForisControllerTesttoolsError):
+    pass
+
+class MessageValidationError(ForisControllerTesttoolsError):
+    pass
@@ -18,6 +18,7 @@
 #
 
 
+import contextlib
 import glob
 import json
 import os
@@ -25,6 +26,7 @@ import pytest
 import shutil
 import subprocess
 import textwrap
+import time
 import warnings
 
 from .infrastructure import (
@@ -33,8 +35,12 @@ from .infrastructure import (
     UnixSocketInfrastructure,
     MQTT_HOST,
     MQTT_PORT,
+    notification_api,
 )
 
+from . import bench
+from . import notifier
+from . import resources
 from . import utils
 from .utils import (
     INIT_SCRIPT_TEST_DIR,
@@ -47,12 +53,21 @@ from .utils import (
     LIGHTTPD_RESTART_CALLED_FILE,
     TURRISHW_ROOT,
 )
+from .checkpoint import NullCheckpoint, SandboxCheckpoint
+from .commands import (
+    CALLS_LOG_PATH,
+    CommandCollector,
+    CommandRecorder,
+    recorded_command_content,
+    shim_command_content,
+)
+from .sandbox import sandbox_path
 
 
-UCI_CONFIG_DIR_PATH = "/tmp/uci_configs"
-FILE_ROOT_PATH = "/tmp/foris_files"
+UCI_CONFIG_DIR_PATH = sandbox_path("UCI_CONFIG_DIR_PATH")
+FILE_ROOT_PATH = sandbox_path("FILE_ROOT_PATH")
 CLIENT_SOCKET_PATH = "/tmp/foris-controller-client-socket.soc"
-REBOOT_INDICATOR_PATH = "/tmp/device-reboot-required"
+REBOOT_INDICATOR_PATH = sandbox_path("REBOOT_INDICATOR_PATH")
 
 
 def _override_exception(instructions):
@@ -62,24 +77,39 @@ def _override_exception(instructions):
     raise NotImplementedError("Override fixture '%s' in conftest.py: %s" % (name, instructions))
 
 
+@pytest.fixture(scope="session")
+def sandbox_checkpoint(request):
+    """ Prepares sandbox paths for the tests
+        With --sandbox-checkpoint the prepared content is captured once and following tests
+        only restore the files which were changed.
+    """
+    # calls of faked commands would otherwise pile up for the whole session
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(CALLS_LOG_PATH)
+
+    if request.config.getoption("--sandbox-checkpoint", False):
+        checkpoint = SandboxCheckpoint()
+    else:
+        checkpoint = NullCheckpoint()
+
+    yield checkpoint
+
+    checkpoint.close()
+
+
 @pytest.fixture(scope="function")
-def init_script_result():
-    try:
-        shutil.rmtree(INIT_SCRIPT_TEST_DIR, ignore_errors=True)
-    except Exception:
-        pass
+def init_script_result(sandbox_checkpoint):
+    def populate():
+        try:
+            os.makedirs(INIT_SCRIPT_TEST_DIR)
+        except Exception:
+            pass
 
-    try:
-        os.makedirs(INIT_SCRIPT_TEST_DIR)
-    except Exception:
-        pass
+    sandbox_checkpoint.restore(INIT_SCRIPT_TEST_DIR, None, populate)
 
     yield INIT_SCRIPT_TEST_DIR
 
-    try:
-        shutil.rmtree(INIT_SCRIPT_TEST_DIR, ignore_errors=True)
-    except Exception:
-        pass
+    sandbox_checkpoint.park(INIT_SCRIPT_TEST_DIR)
 
 
 @pytest.fixture(scope="session")
@@ -200,6 +230,12 @@ def infrastructure(
         CLIENT_SOCKET_PATH,
         debug_output=request.config.getoption("--debug-output"),
         env_overrides=env_overrides,
+        router_profile=request.config.getoption("--router-profile", None),
+        router_profile_buses=request.config.getoption("--router-profile-buses", False),
+        validate_messages=request.config.getoption("--validate-messages", False),
+        profile_controller=request.config.getoption("--profile-controller", False),
+        trace_controller_memory=request.config.getoption("--trace-controller-memory", False),
+        profile_name=f"{request.module.__name__}-{message_bus}-{backend}",
     )
     yield instance
     instance.exit()
@@ -223,7 +259,7 @@ def uci_config_default_path():
 
 
 @pytest.fixture(autouse=True, scope="function")
-def uci_configs_init(request, uci_config_default_path):
+def uci_configs_init(request, uci_config_default_path, sandbox_checkpoint):
     """ Sets directory from where the uci configs should be looaded
         yields path to modified directory and path to original directory
     """
@@ -232,22 +268,23 @@ def uci_configs_init(request, uci_config_default_path):
     else:
         dir_path = uci_config_default_path
 
-    # remove target dir
-    shutil.rmtree(UCI_CONFIG_DIR_PATH, ignore_errors=True)
-    try:
-        os.makedirs(UCI_CONFIG_DIR_PATH)
-    except IOError:
-        pass
+    def populate():
+        try:
+            os.makedirs(UCI_CONFIG_DIR_PATH)
+        except IOError:
+            pass
 
-    # copy all the content of a directory
-    for path in glob.glob("%s/*" % dir_path):
-        shutil.copy(path, UCI_CONFIG_DIR_PATH)
+        # copy all the content of a directory
+        utils.copy_files(glob.glob("%s/*" % dir_path), UCI_CONFIG_DIR_PATH)
+
+    # target dir is removed first
+    sandbox_checkpoint.restore(UCI_CONFIG_DIR_PATH, dir_path, populate)
 
     # yield paths
     yield UCI_CONFIG_DIR_PATH, dir_path
 
     # cleanup
-    shutil.rmtree(UCI_CONFIG_DIR_PATH, ignore_errors=True)
+    sandbox_checkpoint.park(UCI_CONFIG_DIR_PATH)
 
 
 @pytest.fixture(scope="module")
@@ -256,129 +293,190 @@ def file_root():
 
 
 @pytest.fixture(autouse=True, scope="function")
-def file_root_init(request, file_root):
+def file_root_init(request, file_root, sandbox_checkpoint):
     if request.node.get_closest_marker("file_root_path"):
         dir_path = request.node.get_closest_marker("file_root_path").args[0]
     else:
         dir_path = file_root
 
-    shutil.rmtree(FILE_ROOT_PATH, ignore_errors=True)
-    shutil.copytree(dir_path, FILE_ROOT_PATH)
+    sandbox_checkpoint.restore(
+        FILE_ROOT_PATH, dir_path, lambda: utils.copy_tree(dir_path, FILE_ROOT_PATH)
+    )
 
     yield FILE_ROOT_PATH, dir_path
 
-    shutil.rmtree(FILE_ROOT_PATH, ignore_errors=True)
+    sandbox_checkpoint.park(FILE_ROOT_PATH)
 
 
 @pytest.fixture(scope="function")
-def prepare_turrishw():
+def prepare_turrishw(sandbox_checkpoint):
     def prepare(name):
-        utils.prepare_turrishw(name)
+        sandbox_checkpoint.restore(TURRISHW_ROOT, name, lambda: utils.prepare_turrishw(name))
 
     yield prepare
-    shutil.rmtree(TURRISHW_ROOT, ignore_errors=True)
+    sandbox_checkpoint.park(TURRISHW_ROOT)
 
 
 @pytest.fixture(scope="function")
-def clean_reboot_indicator():
-    try:
-        os.unlink(REBOOT_INDICATOR_PATH)
-    except Exception:
-        pass
+def clean_reboot_indicator(sandbox_checkpoint):
+    sandbox_checkpoint.restore(REBOOT_INDICATOR_PATH, None, lambda: None)
 
     yield REBOOT_INDICATOR_PATH
 
-    try:
-        os.unlink(REBOOT_INDICATOR_PATH)
-    except Exception:
-        pass
+    sandbox_checkpoint.park(REBOOT_INDICATOR_PATH)
 
 
 @pytest.fixture(scope="function")
-def updater_userlists():
+def updater_userlists(sandbox_checkpoint):
     from .svupdater import lists
 
-    try:
-        os.unlink(lists.LISTS_FILE_PATH)
-    except Exception:
-        pass
-
-    set_package_lists()
+    sandbox_checkpoint.restore(lists.LISTS_FILE_PATH, None, set_package_lists)
     yield lists.LISTS_FILE_PATH
 
-    try:
-        os.unlink(lists.LISTS_FILE_PATH)
-    except Exception:
-        pass
+    sandbox_checkpoint.park(lists.LISTS_FILE_PATH)
 
 
 @pytest.fixture(scope="function")
-def updater_languages():
+def updater_languages(sandbox_checkpoint):
     from .svupdater import l10n
 
-    try:
-        os.unlink(l10n.LANGS_FILE_PATH)
-    except Exception:
-        pass
-
-    set_languages()
+    sandbox_checkpoint.restore(l10n.LANGS_FILE_PATH, None, set_languages)
     yield l10n.LANGS_FILE_PATH
 
-    try:
-        os.unlink(l10n.LANGS_FILE_PATH)
-    except Exception:
-        pass
+    sandbox_checkpoint.park(l10n.LANGS_FILE_PATH)
 
 
 @pytest.fixture(scope="module")
 def notify_cmd(infrastructure):
     def notify(module, action, data, validate=True):
         args = ["foris-notify", "-m", module, "-a", action]
-        if infrastructure.name in ["ubus", "unix-socket"]:
-            args.extend([infrastructure.name, "--path", infrastructure.notification_sock_path])
-        elif infrastructure.name in ["mqtt"]:
-            args.extend([infrastructure.name, "--host", MQTT_HOST, "--port", str(MQTT_PORT)])
-
+        args.extend(notifier.bus_arguments(infrastructure))
         args.append(json.dumps(data))
 
         if not validate:
             args.insert(1, "-n")
+        sent = time.time()
         process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         stdout, stderr = process.communicate()
+        if process.returncode == 0:
+            # timed separately, the latency includes the start of foris-notify
+            infrastructure.note_notification_sent(module, action, sent, origin="notify_cmd")
         return process.returncode, stdout, stderr
 
     yield notify
 
 
+@pytest.fixture(autouse=True, scope="function")
+def notification_segment(request):
+    """ With --segment-notifications each test using the infrastructure starts
+        with an empty notification log (see Infrastructure.rotate_notifications),
+        notifications of the previous test which are still in flight may still appear
+    """
+    if request.config.getoption("--segment-notifications", False):
+        if "infrastructure" in request.fixturenames:
+            request.getfixturevalue("infrastructure").rotate_notifications()
+    yield
+
+
+@pytest.fixture(autouse=True, scope="function")
+def process_resources(request):
+    """ With --track-resources CPU time, RSS, open fds and threads of foris-controller,
+        the message bus and the notification listener are sampled before and after each test
+
+        Deltas are stored in the test's user_properties ("process_resources"),
+        tests which exceed the thresholds get "resource_flags" and a ResourceWarning.
+    """
+    if not request.config.getoption("--track-resources", False):
+        yield None
+        return
+    if "infrastructure" not in request.fixturenames:
+        yield None
+        return
+
+    infrastructure = request.getfixturevalue("infrastructure")
+    before = infrastructure.sample_processes()
+    yield before
+    deltas = resources.process_deltas(before, infrastructure.sample_processes())
+
+    request.node.user_properties.append(("process_resources", deltas))
+    reasons = resources.RESOURCE_USAGE.add(
+        request.node.nodeid,
+        deltas,
+        int(request.config.getoption("--resource-rss-threshold") * resources.MiB),
+        request.config.getoption("--resource-fd-threshold"),
+    )
+    if reasons:
+        request.node.user_properties.append(("resource_flags", reasons))
+        warnings.warn(ResourceWarning("%s: %s" % (request.node.nodeid, ", ".join(reasons))))
+
+
+@pytest.fixture(scope="function")
+def notification_filters(infrastructure):
+    """ Returns a function which sets (module, action) pairs of notifications the listener records
+        (action None matches any action of the module)
+
+        Other notifications are dropped in the listener (mqtt doesn't even subscribe to them).
+        All notifications are recorded again after the test.
+    """
+    yield infrastructure.set_notification_filters
+    infrastructure.set_notification_filters(None)
+
+
+@pytest.fixture(scope="module")
+def notify_batch(infrastructure, extra_module_paths):
+    """ Same as notify_cmd, but a single sender process is kept running
+
+        yields a function which accepts a list of (module, action, data[, validate])
+        and returns [(retcode, stdout, stderr), ...]
+    """
+    with notifier.NotifierProcess(infrastructure, extra_module_paths) as process:
+        yield process.notify
+
+
 @pytest.fixture(scope="module")
 def notify_api(extra_module_paths, infrastructure):
-    if infrastructure.name == "ubus":
-        from foris_controller.buses.ubus import UbusNotificationSender
+    with notification_api(infrastructure, extra_module_paths) as notify:
+        yield notify
+
+
+@pytest.fixture(scope="function")
+def notification_benchmark(infrastructure, notify_api):
+    """ Returns a function which floods the bus with notifications
+        and returns bench.NotificationBenchResult
+    """
 
-        sender = UbusNotificationSender(infrastructure.notification_sock_path)
+    def run(count=1000, timeout=30.0):
+        return bench.notification_flood(infrastructure, notify_api, count, timeout)
 
-    elif infrastructure.name == "unix-socket":
-        from foris_controller.buses.unix_socket import UnixSocketNotificationSender
+    return run
 
-        sender = UnixSocketNotificationSender(infrastructure.notification_sock_path)
 
-    elif infrastructure.name == "mqtt":
-        from foris_controller.buses.mqtt import MqttNotificationSender
+@pytest.fixture(scope="function")
+def load_generator(infrastructure):
+    """ Returns a function which drives a mix of requests (bench.LoadRequest)
+        against the controller and returns bench.LoadResult
 
-        sender = MqttNotificationSender(MQTT_HOST, MQTT_PORT, None)
+        see bench.request_load for the arguments
+    """
 
-    def notify(module, action, notification=None, validate=True):
-        from foris_controller.utils import get_validator_dirs
-        from foris_schema import ForisValidator
+    def run(requests, **kwargs):
+        return bench.request_load(infrastructure, requests, **kwargs)
 
-        if validate:
-            validator = ForisValidator(*get_validator_dirs([module], extra_module_paths))
-        else:
-            validator = None
-        sender.notify(module, action, notification, validator)
+    return run
 
-    yield notify
-    sender.disconnect()
+
+@pytest.fixture(scope="function")
+def payload_benchmark(infrastructure):
+    """ Returns a function which measures round trips of requests with growing payloads
+        and returns a list of bench.PayloadResult
+
+        see bench.payload_sweep for the arguments
+    """
+
+    def run(module, action, **kwargs):
+        return bench.payload_sweep(infrastructure, module, action, **kwargs)
+
+    return run
 
 
 CALLED_COMMAND_TEMPLATE = """\
@@ -388,10 +486,68 @@ exit 0
 """
 
 
+@contextlib.contextmanager
+def _fake_command(
+    cmdline_script_root, command_collector, command_latency, command, called_file
+):
+    latency = command_latency.get(command)
+    if command_collector:
+        content = shim_command_content(command, called_file, command_collector.socket_path)
+        command_collector.set_latency(command, latency)
+    else:
+        content = recorded_command_content(command, called_file, latency=latency)
+
+    with FileFaker(cmdline_script_root, command, True, textwrap.dedent(content)):
+        yield called_file
+
+    if command_collector:
+        command_collector.reset_responses()
+
+
+@pytest.fixture(scope="module")
+def command_latency():
+    """ Latency profiles of faked commands {"/usr/bin/maintain-reboot": FixedLatency(0.3), ...}
+        (see commands.LatencyProfile)
+    """
+    return {}  # by default commands return instantly, test should override this fixture
+
+
+@pytest.fixture(scope="session")
+def command_collector(request):
+    """ Collector of the shim commands calls (None unless --command-shims is used) """
+    if not request.config.getoption("--command-shims", False):
+        yield None
+        return
+
+    collector = CommandCollector()
+    collector.start()
+    yield collector
+    collector.stop()
+
+
+@pytest.fixture(scope="function")
+def command_recorder(command_collector):
+    """ Structured records of calls of the faked commands (see commands.CommandRecorder) """
+    recorder = command_collector.recorder if command_collector else CommandRecorder()
+    recorder.clear()
+
+    yield recorder
+
+    try:
+        os.unlink(recorder.log_path)
+    except Exception:
+        pass
+
+
 @pytest.fixture(scope="function")
-def sh_command(cmdline_script_root):
-    content = CALLED_COMMAND_TEMPLATE % dict(path=SH_CALLED_FILE)
-    with FileFaker(cmdline_script_root, "/bin/sh", True, textwrap.dedent(content)):
+def sh_command(cmdline_script_root, command_collector, command_latency):
+    with _fake_command(
+        cmdline_script_root,
+        command_collector,
+        command_latency,
+        "/bin/sh",
+        SH_CALLED_FILE,
+    ):
         yield SH_CALLED_FILE
     try:
         os.unlink(SH_CALLED_FILE)
@@ -400,9 +556,14 @@ def sh_command(cmdline_script_root):
 
 
 @pytest.fixture(scope="function")
-def reboot_command(cmdline_script_root):
-    content = CALLED_COMMAND_TEMPLATE % dict(path=REBOOT_CALLED_FILE)
-    with FileFaker(cmdline_script_root, "/usr/bin/maintain-reboot", True, textwrap.dedent(content)):
+def reboot_command(cmdline_script_root, command_collector, command_latency):
+    with _fake_command(
+        cmdline_script_root,
+        command_collector,
+        command_latency,
+        "/usr/bin/maintain-reboot",
+        REBOOT_CALLED_FILE,
+    ):
         yield REBOOT_CALLED_FILE
     try:
         os.unlink(REBOOT_CALLED_FILE)
@@ -411,10 +572,13 @@ def reboot_command(cmdline_script_root):
 
 
 @pytest.fixture(scope="function")
-def network_restart_command(cmdline_script_root):
-    content = CALLED_COMMAND_TEMPLATE % dict(path=NETWORK_RESTART_CALLED_FILE)
-    with FileFaker(
-        cmdline_script_root, "/usr/bin/maintain-network-restart", True, textwrap.dedent(content)
+def network_restart_command(cmdline_script_root, command_collector, command_latency):
+    with _fake_command(
+        cmdline_script_root,
+        command_collector,
+        command_latency,
+        "/usr/bin/maintain-network-restart",
+        NETWORK_RESTART_CALLED_FILE,
     ):
         yield NETWORK_RESTART_CALLED_FILE
     try:
@@ -424,10 +588,13 @@ def network_restart_command(cmdline_script_root):
 
 
 @pytest.fixture(scope="function")
-def lighttpd_restart_command(cmdline_script_root):
-    content = CALLED_COMMAND_TEMPLATE % dict(path=LIGHTTPD_RESTART_CALLED_FILE)
-    with FileFaker(
-        cmdline_script_root, "/usr/bin/maintain-lighttpd-restart", True, textwrap.dedent(content)
+def lighttpd_restart_command(cmdline_script_root, command_collector, command_latency):
+    with _fake_command(
+        cmdline_script_root,
+        command_collector,
+        command_latency,
+        "/usr/bin/maintain-lighttpd-restart",
+        LIGHTTPD_RESTART_CALLED_FILE,
     ):
         yield LIGHTTPD_RESTART_CALLED_FILE
     try:
@@ -19,28 +19,40 @@
 
 
 import abc
+import codecs
+import collections
+import collections.abc
+import contextlib
+import copy
 import itertools
 import json
 import os
-import re
 import subprocess
 import socket
 import struct
 import sys
+import threading
 import time
+import tracemalloc
 import typing
 import uuid
+import warnings
 
 
 from paho import mqtt as mqtt_module
 from paho.mqtt import client as mqtt
-from multiprocessing import Process, Value, Lock
-
-from .exceptions import BackendNotImplementedError
+from multiprocessing import Lock, Pipe, Process
+
+from . import listener
+from . import perf
+from . import profiler
+from . import validation
+from .exceptions import BackendNotImplementedError, MessageValidationError
+from .notifications import NotificationIndex
+from .resources import ROUTER_PROFILES, ProcessSamples, router_profile_preexec, sample_process
+from .sandbox import SANDBOX_ROOT_ENV, get_sandbox_root, sandbox_path
 from .utils import TURRISHW_ROOT
 
-import socketserver
-
 
 def mqtt_client_extra():
     if mqtt_module.__version__.split(".")[0] not in ["1", "0"]:
@@ -54,14 +66,113 @@ def mqtt_client_extra():
 SOCK_PATH = "/tmp/foris-controller-test.soc"
 UBUS_PATH = "/tmp/ubus-foris-controller-test.soc"
 NOTIFICATION_SOCK_PATH = "/tmp/foris-controller-notifications-test.soc"
-NOTIFICATIONS_OUTPUT_PATH = "/tmp/foris-controller-notifications-test.json"
+NOTIFICATIONS_OUTPUT_PATH = sandbox_path("NOTIFICATIONS_OUTPUT_PATH")
 MQTT_HOST = "localhost"
 MQTT_PORT = 11883
 MQTT_ID = os.environ.get("TEST_CLIENT_ID", f"{uuid.getnode():016X}")
+UBUS_CHUNK_SIZE = 512 * 1024  # larger ubus payloads are sent as multipart messages
+
+NOTIFICATION_META_KEY = listener.NOTIFICATION_META_KEY
+LISTENER_REPLY_TIMEOUT = 5.0
+NOTIFICATION_POLL_TIMEOUT = 0.5  # how long the listener holds a flush request without news
+LEGACY_LISTENER_POLL = 0.05  # polling of listeners started by an overridden make_listener
+PROFILE_DUMP_TIMEOUT = 30.0  # writing stats of a profiled controller may take a while
 
 notifications_lock = Lock()
 
 
+class MultipartStats(typing.NamedTuple):
+    chunks: int = 0
+    size: int = 0  # characters sent in the multipart chunks
+    chunk_times: typing.Tuple[float, ...] = ()  # duration of each chunk call
+    peak_memory: typing.Optional[int] = None  # bytes allocated on top of the baseline
+
+
+def _is_json_stream(source: typing.Any) -> bool:
+    return hasattr(source, "read") or isinstance(source, collections.abc.Iterator)
+
+
+def iter_json_chunks(source: typing.Any, chunk_size: int) -> typing.Iterator[str]:
+    """ Encodes data incrementally and yields chunks of at most chunk_size characters
+
+    :param source: object to be serialized, file-like object or iterator of serialized JSON
+    :param chunk_size: maximal size of a chunk
+    """
+    if hasattr(source, "read"):
+        # read(0) returns an empty str / bytes which marks the end of the file
+        pieces = iter(lambda: source.read(chunk_size), source.read(0))
+    elif isinstance(source, collections.abc.Iterator):
+        pieces = source
+    else:
+        pieces = json.JSONEncoder().iterencode(source)
+
+    # bytes pieces may split a multibyte character
+    decoder = codecs.getincrementaldecoder("utf8")()
+    buffer = []
+    buffered = 0
+    for piece in pieces:
+        if isinstance(piece, bytes):
+            piece = decoder.decode(piece)
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= chunk_size:
+            joined = "".join(buffer)
+            for i in range(0, len(joined) - chunk_size + 1, chunk_size):
+                yield joined[i : i + chunk_size]
+            rest = joined[len(joined) - len(joined) % chunk_size :]
+            buffer = [rest] if rest else []
+            buffered = len(rest)
+    decoder.decode(b"", final=True)  # raises when the source ends within a character
+    if buffered:
+        yield "".join(buffer)
+
+
+# native-endian 32-bit length followed by JSON (framing of foris-controller's unix-socket bus)
+FRAME_HEADER = struct.Struct("I")
+FRAME_BUFFER_SIZE = 64 * 1024  # size of the buffers the encoded message is split into
+SENDMSG_MAX_BUFFERS = 512  # stays well below IOV_MAX
+
+
+def encode_message(msg: typing.Any) -> typing.List[bytes]:
+    """ Encodes a message to a list of buffers (without joining the whole message) """
+    res = []
+    for chunk in iter_json_chunks(msg, FRAME_BUFFER_SIZE):
+        res.append(chunk.encode("utf8"))
+    return res
+
+
+def send_frame(sock: socket.socket, buffers: typing.List[bytes]):
+    """ Sends a length-prefixed frame using scatter/gather I/O (sendmsg) """
+    views = [memoryview(FRAME_HEADER.pack(sum(len(e) for e in buffers)))]
+    views.extend(memoryview(e) for e in buffers if e)
+    while views:
+        sent = sock.sendmsg(views[:SENDMSG_MAX_BUFFERS])
+        # drop fully sent buffers and trim the partially sent one
+        while sent and sent >= len(views[0]):
+            sent -= len(views.pop(0))
+        if sent:
+            views[0] = views[0][sent:]
+
+
+def recv_exact(sock: socket.socket, size: int) -> bytearray:
+    """ Reads exactly size bytes from the socket """
+    res = bytearray(size)
+    view = memoryview(res)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if not count:
+            raise ConnectionError(f"connection closed after {received} of {size} bytes")
+        received += count
+    return res
+
+
+def recv_frame(sock: socket.socket) -> typing.Any:
+    """ Reads a length-prefixed frame and decodes it """
+    length = FRAME_HEADER.unpack(recv_exact(sock, FRAME_HEADER.size))[0]
+    return json.loads(recv_exact(sock, length).decode("utf8"))
+
+
 def _wait_for_ubus_module(module, socket_path, timeout=2):
     import ubus
 
@@ -98,26 +209,14 @@ class ClientSocket:
 
         self.socket.settimeout(timeout)
 
-        data = json.dumps(msg).encode("utf8")
-        length_bytes = struct.pack("I", len(data))
-        self.socket.sendall(length_bytes + data)
-
-        length = struct.unpack("I", self.socket.recv(4))[0]
-        received = self.socket.recv(length)
-        recv_len = len(received)
-        while recv_len < length:
-            received += self.socket.recv(length)
-            recv_len = len(received)
-
-        return json.loads(received.decode("utf8"))
+        send_frame(self.socket, encode_message(msg))
+        return recv_frame(self.socket)
 
     def notification(self, msg):
         if not self.socket:
             self.connect()
 
-        data = json.dumps(msg).encode("utf8")
-        length_bytes = struct.pack("I", len(data))
-        self.socket.sendall(length_bytes + data)
+        send_frame(self.socket, encode_message(msg))
 
 
 class Infrastructure(metaclass=abc.ABCMeta):
@@ -145,15 +244,127 @@ class Infrastructure(metaclass=abc.ABCMeta):
         new_env["FORIS_CMDLINE_ROOT"] = cmdline_script_root
         new_env["FORIS_FILE_ROOT"] = file_root
         new_env["TURRISHW_ROOT"] = TURRISHW_ROOT
+        new_env[SANDBOX_ROOT_ENV] = get_sandbox_root()
         new_env["FC_UPDATER_MODULE"] = "foris_controller_testtools.svupdater"
 
         new_env.update(env_overrides)
 
         return new_env
 
-    @abc.abstractmethod
+    def profile_kwargs(self, bus: bool = False) -> dict:
+        """ Popen arguments which apply the router profile (if set) """
+        if not self.router_profile or (bus and not self.router_profile_buses):
+            return {}
+        return {"preexec_fn": router_profile_preexec(self.router_profile)}
+
     def make_listener(self):
-        pass
+        self._listener_control, control = Pipe()
+        self.listener = Process(
+            target=listener.run_listener,
+            args=(self.name, control, NOTIFICATIONS_OUTPUT_PATH, notifications_lock)
+            + self.listener_args(),
+        )
+        self.listener.start()
+        control.close()
+
+    def listener_args(self) -> tuple:
+        """ Arguments of the listener source (see listener.SOURCES)
+
+            Subclasses implement this unless they override make_listener.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} implements neither listener_args nor make_listener"
+        )
+
+    def _listener_request(self, command: str, *args, timeout: float = LISTENER_REPLY_TIMEOUT):
+        """ Sends a control command to the listener and waits for its reply
+
+            Late replies of earlier requests (which timed out) are discarded.
+
+        :returns: value of the reply or None when the listener didn't reply in time
+        :raises EOFError, OSError: when the listener is not running
+        """
+        if self._listener_control is None:
+            # started by an overridden make_listener, it writes notifications at once
+            raise OSError("listener has no control connection")
+        with self._listener_lock:
+            self._listener_seq += 1
+            seq = self._listener_seq
+            self._listener_control.send((seq, command) + args)
+            deadline = time.monotonic() + timeout
+            while self._listener_control.poll(max(deadline - time.monotonic(), 0)):
+                reply_seq, _, value = self._listener_control.recv()
+                if reply_seq == seq:
+                    return value
+            return None
+
+    def flush_notifications(self, wait: float = 0.0) -> int:
+        """ Makes the listener write the received notifications to NOTIFICATIONS_OUTPUT_PATH
+
+        :param wait: when there is nothing to write, wait up to this many seconds
+                     for a new notification
+        :returns: number of notifications written
+        """
+        if self._listener_control is None:
+            # listener started by an overridden make_listener writes notifications at once
+            time.sleep(min(wait, LEGACY_LISTENER_POLL))
+            return 0
+        try:
+            return self._listener_request("flush", wait, timeout=wait + LISTENER_REPLY_TIMEOUT) or 0
+        except (EOFError, OSError):
+            return 0  # listener is not running
+
+    def set_notification_filters(
+        self, filters: typing.Optional[typing.Iterable[typing.Tuple[str, typing.Optional[str]]]]
+    ):
+        """ Makes the listener record only the matching notifications
+
+            Pending notifications are written first, so nothing received earlier is lost.
+
+        :param filters: (module, action) pairs (action None = any action), None = record all
+        """
+        self.flush_notifications()
+        try:
+            self._listener_request(
+                "filters", None if filters is None else [list(e) for e in filters]
+            )
+        except (EOFError, OSError):
+            pass  # listener is not running
+
+    def rotate_notifications(self):
+        """ Starts a new segment of the notification log
+
+            Notifications received so far are discarded (their delivery latencies are recorded),
+            so following reads see only the new ones.
+
+            Rotation is not a barrier for notifications which are still on their way
+            (e.g. sent by the controller in reply to a request of the previous test):
+            when the listener receives them after the rotation they land in the new segment.
+        """
+        self.flush_notifications()
+        self.collect_notification_latencies()
+        try:
+            segment = self._listener_request("rotate")
+        except (EOFError, OSError):
+            return  # listener is not running
+        if segment is not None:
+            self.notification_segment = segment
+        self.notification_index.clear()
+        self._sent_notifications.clear()
+
+    def stop_listener(self):
+        if self._listener_control is None:  # started by an overridden make_listener
+            self.listener.terminate()
+            self.listener.join()
+            return
+        try:
+            self._listener_request("exit")
+        except (EOFError, OSError):
+            pass
+        self.listener.join(LISTENER_REPLY_TIMEOUT)
+        if self.listener.is_alive():
+            self.listener.terminate()
+        self._listener_control.close()
 
     @abc.abstractmethod
     def bus_options(self) -> typing.List[str]:
@@ -170,21 +381,42 @@ class Infrastructure(metaclass=abc.ABCMeta):
         client_socket_path=None,
         debug_output=False,
         env_overrides={},
+        router_profile=None,
+        router_profile_buses=False,
+        validate_messages=False,
+        profile_controller=False,
+        trace_controller_memory=False,
+        profile_name=None,
     ):
         self.debug_output = debug_output
-
-        self.start_message_bus()
-        self.init_socket_client(client_socket_path)
+        self.extra_module_paths = extra_module_paths
+        self.validate_messages = validate_messages
+        self.last_request_time = None
+        self._sent_notifications = collections.defaultdict(collections.deque)
+        self.notification_index = NotificationIndex()
+        self.notification_segment = 0
+        self._listener_control = None
+        self._listener_lock = threading.Lock()
+        self._listener_seq = 0
+        self.router_profile = ROUTER_PROFILES[router_profile] if router_profile else None
+        self.router_profile_buses = router_profile_buses
+        self.profile_output = None
+        if profile_controller or trace_controller_memory:
+            self.profile_output = profiler.output_prefix(profile_name or self.name)
 
         self.backend_name = backend_name
         if backend_name not in ["openwrt", "mock"]:
             raise BackendNotImplementedError("Unsupported backend '{}'".format(backend_name))
 
+        self.start_message_bus()
+        self.init_socket_client(client_socket_path)
+
         kwargs = {
             "env": self.get_environment(
                 env_overrides, uci_config_dir, cmdline_script_root, file_root
             )
         }
+        kwargs.update(self.profile_kwargs())
         if not debug_output:
             devnull = open(os.devnull, "wb")
             kwargs["stderr"] = devnull
@@ -198,8 +430,14 @@ class Infrastructure(metaclass=abc.ABCMeta):
         )
 
         client_socket_option = ["-C", client_socket_path] if client_socket_path else []
+        if self.profile_output:
+            command = profiler.wrapper_command(
+                self.profile_output, profile_controller, trace_controller_memory
+            )
+        else:
+            command = ["foris-controller"]
         args = (
-            ["foris-controller"]
+            command
             + modules
             + extra_paths
             + client_socket_option
@@ -208,29 +446,199 @@ class Infrastructure(metaclass=abc.ABCMeta):
 
         args.extend(self.bus_options())
 
-        self.server = subprocess.Popen(args, **kwargs)
+        self.server = None
         self.connected = False
+        try:
+            self.server = subprocess.Popen(args, **kwargs)
+        except OSError:
+            # e.g. foris-controller is not installed, the bus and the listener are already running
+            self.exit()
+            raise
 
     def exit(self):
-        self.server.kill()
-        self.listener.terminate()
-        self.client_socket.close()
+        with contextlib.ExitStack() as stack:
+            # callbacks run in reverse order and all of them run even when some of them fail
+            # (the bus daemon must not outlive the infrastructure)
+            stack.callback(self.terminate_message_bus)
+            stack.callback(self._remove_files)
+            stack.callback(self.collect_notification_latencies)
+            if self.client_socket is not None:
+                stack.callback(self.client_socket.close)
+            stack.callback(self.stop_listener)
+            if self.server is not None:
+                stack.callback(
+                    self.stop_profiled_server if self.profile_output else self.server.kill
+                )
+
+    def _remove_files(self):
         for path in [NOTIFICATIONS_OUTPUT_PATH, self.client_socket_path]:
+            if not path:
+                continue
             try:
                 os.unlink(path)
             except OSError:
                 pass
-        self.terminate_message_bus()
+
+    def stop_profiled_server(self):
+        """ Lets the profiled controller exit gracefully, so it can write its stats,
+            and merges them into profiler.CONTROLLER_PROFILES
+        """
+        self.server.terminate()
+        try:
+            self.server.wait(PROFILE_DUMP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            # killed while (or before) writing, the stats are missing or incomplete
+            self.server.kill()
+            self.server.wait()
+            return
+        profiler.CONTROLLER_PROFILES.add(self.profile_output)
 
     @staticmethod
     def chunks(data, size):
         for i in range(0, len(data), size):
             yield data[i : i + size]
 
-    @abc.abstractmethod
-    def process_message(self, data):
+    def wait_ready(self):
+        """ Waits till the controller is able to process messages """
         pass
 
+    def process_message(self, data):
+        """ Sends a request to foris-controller and returns the reply
+            Round trip duration is recorded to perf.REQUEST_LATENCIES
+
+            When validate_messages is set the request and the reply are validated
+            against the module's schema (MessageValidationError is raised).
+            Invalid requests are still sent, but the controller has to reply with errors.
+
+            Subclasses implement _process_message(). Subclasses which override this method
+            instead still work, but their requests are neither timed nor validated.
+        """
+        self.wait_ready()
+        request_error = self.validate_message(data) if self.validate_messages else None
+
+        self.last_request_time = time.time()
+        start = time.perf_counter()
+        try:
+            reply = self._process_message(data)
+        finally:
+            perf.REQUEST_LATENCIES.add(
+                (self.name, data.get("module", "?"), data.get("action", "?")),
+                time.perf_counter() - start,
+            )
+
+        if self.validate_messages and isinstance(reply, dict) and "errors" not in reply:
+            if request_error is not None:
+                raise MessageValidationError(
+                    f"invalid request was accepted by foris-controller: {request_error}"
+                )
+            reply_error = self.validate_message(reply)
+            if reply_error is not None:
+                raise MessageValidationError(f"invalid reply: {reply_error}")
+
+        return reply
+
+    def validate_message(self, message: dict) -> typing.Optional[str]:
+        """ Validates a message against the schema of its module
+
+            Duration is recorded to perf.VALIDATION_LATENCIES (loading of the schemas is not)
+        :returns: None if the message is valid, error description otherwise
+        """
+        module = message.get("module", "?")
+        action = message.get("action", "?")
+        name = f"{module}.{action} ({message.get('kind')})"
+        try:
+            validator = validation.get_validator([module], self.extra_module_paths)
+        except Exception as exc:
+            # e.g. a negative test with a misspelled module, the request is still sent
+            return f"{name}: no schema for module {module} ({exc})"
+        start = time.perf_counter()
+        try:
+            validator.validate(message)
+        except Exception as exc:
+            return f"{name}: {exc}"
+        finally:
+            perf.VALIDATION_LATENCIES.add(
+                (self.name, message.get("kind", "?"), module, action),
+                time.perf_counter() - start,
+            )
+        return None
+
+    def _process_message(self, data):
+        """ Sends a request over the bus and returns the reply (see process_message) """
+        raise NotImplementedError(
+            f"{type(self).__name__} has to implement _process_message() or process_message()"
+        )
+
+    def note_notification_sent(
+        self,
+        module: str,
+        action: str,
+        sent: typing.Optional[float] = None,
+        origin: str = "sender",
+    ):
+        """ Marks that a notification was sent (to measure its delivery latency)
+
+            Call it only after the notification was sent successfully, otherwise
+            the time would be matched with a later notification of the same kind.
+
+        :param sent: time.time() taken right before the notification was sent (now by default)
+        :param origin: kind of the sender, latencies of each kind are recorded separately
+                       (e.g. "notify_cmd" includes the start of foris-notify)
+        """
+        self._sent_notifications[(module, action)].append(
+            (time.time() if sent is None else sent, origin)
+        )
+
+    def _record_delivery(self, msg: dict, meta: dict):
+        received = meta.get("received")
+        if received is None:
+            return
+
+        key = (msg["module"], msg["action"])
+        pending = self._sent_notifications.get(key)
+        if pending and pending[0][0] <= received:
+            since, origin = pending.popleft()
+        elif self.last_request_time is not None and self.last_request_time <= received:
+            # controller notification is measured since the last request was sent
+            origin, since = "controller", self.last_request_time
+        else:
+            return
+
+        perf.NOTIFICATION_LATENCIES.add((self.name, origin) + key, received - since)
+
+    def read_notifications(self) -> typing.List[dict]:
+        """ Reads notifications written by the listener since the last read
+            (they are added to notification_index and their delivery latencies are recorded)
+        """
+        res = []
+        new = self.notification_index.read(NOTIFICATIONS_OUTPUT_PATH, notifications_lock)
+        for msg, meta in new:
+            self._record_delivery(msg, meta)
+            res.append(msg)
+        return res
+
+    def collect_notification_latencies(self):
+        """ Records delivery latencies of notifications which were not read yet """
+        self.read_notifications()
+
+    def notifications_since(
+        self, seq: int, module: typing.Optional[str] = None, action: typing.Optional[str] = None
+    ) -> typing.List[dict]:
+        """ Returns notifications received after the one with sequence number seq
+            (see NotificationIndex.notifications_since)
+        """
+        self.flush_notifications()
+        self.read_notifications()
+        return copy.deepcopy(self.notification_index.notifications_since(seq, module, action))
+
+    def last_notification(
+        self, module: typing.Optional[str] = None, action: typing.Optional[str] = None
+    ) -> typing.Optional[dict]:
+        """ Returns the last received notification (of the module / action) or None """
+        self.flush_notifications()
+        self.read_notifications()
+        return copy.deepcopy(self.notification_index.last(module, action))
+
     def get_notifications(self, old_data=None, filters=[]):
         def filter_data(data):
             if data is None:
@@ -238,19 +646,42 @@ class Infrastructure(metaclass=abc.ABCMeta):
             else:
                 return [e for e in data if not filters or (e["module"], e["action"]) in filters]
 
-        while not os.path.exists(NOTIFICATIONS_OUTPUT_PATH):
-            time.sleep(0.2)
-
-        global notifications_lock
-
+        old_filtered = filter_data(old_data)
+        wait = 0.0
         while True:
-            with notifications_lock, open(NOTIFICATIONS_OUTPUT_PATH) as f:
-                data = f.readlines()
-                last_data = [json.loads(e.strip()) for e in data]
-                filtered_data = filter_data(last_data)
-                if not filter_data(old_data) == filtered_data:
-                    break
-        return filtered_data
+            self.flush_notifications(wait=wait)
+            self.read_notifications()
+            if filters:
+                filtered_data = self.notification_index.select(filters)
+            else:
+                filtered_data = list(self.notification_index.messages)
+            if not old_filtered == filtered_data:
+                break
+            # returns as soon as the listener has something new (or after a while)
+            wait = NOTIFICATION_POLL_TIMEOUT
+        # the index keeps the notifications, callers may modify what they get
+        return copy.deepcopy(filtered_data)
+
+    def bus_pid(self) -> typing.Optional[int]:
+        """ Process id of the message bus daemon (None when there is no such process) """
+        return None
+
+    def child_pids(self) -> typing.Dict[str, int]:
+        """ Process ids of the processes started by the infrastructure """
+        res = {"controller": self.server.pid, "listener": self.listener.pid}
+        bus_pid = self.bus_pid()
+        if bus_pid is not None:
+            res["bus"] = bus_pid
+        return res
+
+    def sample_processes(self) -> ProcessSamples:
+        """ Samples resource usage (CPU time, RSS, open fds, threads) of the child processes """
+        res = {}
+        for role, pid in self.child_pids().items():
+            sample = sample_process(pid)
+            if sample is not None:
+                res[role] = (pid, sample)
+        return res
 
     @abc.abstractmethod
     def start_message_bus(self):
@@ -272,9 +703,8 @@ class MqttInfrastructure(Infrastructure):
     def bus_options(self) -> typing.List[str]:
         return ["--host", MQTT_HOST, "--port", str(MQTT_PORT)]
 
-    def make_listener(self):
-        self.listener = Process(target=mqtt_notification_listener, args=(MQTT_HOST, MQTT_PORT))
-        self.listener.start()
+    def listener_args(self) -> tuple:
+        return (MQTT_HOST, MQTT_PORT)
 
     def wait_mqtt_connected(self):
         """ wait till foris-controller connects to mqtt """
@@ -299,9 +729,10 @@ class MqttInfrastructure(Infrastructure):
             client.disconnect()
             self.connected = True
 
-    def process_message(self, data):
+    def wait_ready(self):
         self.wait_mqtt_connected()
 
+    def _process_message(self, data):
         output = {}
         msg_id = uuid.uuid1()
 
@@ -337,7 +768,7 @@ class MqttInfrastructure(Infrastructure):
         return output
 
     def start_message_bus(self):
-        kwargs = {}
+        kwargs = self.profile_kwargs(bus=True)
         if not self.debug_output:
             devnull = open(os.devnull, "wb")
             kwargs["stderr"] = devnull
@@ -351,6 +782,9 @@ class MqttInfrastructure(Infrastructure):
         client = mqtt.Client(**mqtt_client_extra())
         wait_mqtt_client_connected(client, MQTT_HOST, MQTT_PORT, timeout=30)
 
+    def bus_pid(self) -> typing.Optional[int]:
+        return self.mosquitto_instance.pid
+
     def terminate_message_bus(self):
         self.mosquitto_instance.kill()
 
@@ -362,18 +796,20 @@ class UbusInfrastructure(Infrastructure):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.notification_sock_path = UBUS_PATH
+        self.multipart_chunk_size = UBUS_CHUNK_SIZE
+        self.last_multipart_stats = MultipartStats()
+        # single ubus connection is kept for the whole lifetime of the infrastructure
+        self.connect_count = 0
+        self.reconnect_count = 0
+        self._ready_modules: typing.Set[str] = set()
 
     def bus_options(self) -> typing.List[str]:
         return ["--path", UBUS_PATH]
 
-    def make_listener(self):
-        self._exiting = Value("i", 0)
-        self._exiting.value = False
-        self.listener = Process(target=ubus_notification_listener, args=(self._exiting,))
-        self.listener.start()
+    def listener_args(self) -> tuple:
+        return (UBUS_PATH,)
 
     def exit(self):
-        self._exiting.value = True
         super().exit()
         try:
             import ubus  # disconnect from ubus if connected
@@ -382,21 +818,124 @@ class UbusInfrastructure(Infrastructure):
         except Exception:
             pass
 
-    def process_message(self, data):
+    def _process_message(self, data):
+        return self._call_ubus(
+            data.get("module", "?"),
+            data.get("action", "?"),
+            data.get("data", None),
+            self.multipart_chunk_size,
+        )
+
+    def process_message_streamed(
+        self,
+        module: str,
+        action: str,
+        source: typing.Any,
+        chunk_size: typing.Optional[int] = None,
+        trace_memory: bool = False,
+    ):
+        """ Sends a request which data are encoded incrementally (multipart if needed)
+
+            Unlike process_message() the whole serialized payload is never held in memory.
+            Stats of the transfer are stored in `last_multipart_stats`.
+
+        :param module: module name
+        :param action: action name
+        :param source: request data - object (encoded via JSONEncoder.iterencode),
+                       file-like object or iterator which produce serialized JSON
+        :param chunk_size: size of the multipart chunks (characters)
+        :param trace_memory: measure peak memory allocated during the call (tracemalloc)
+        """
+        self.wait_ready()
+        started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if trace_memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+
+        self.last_request_time = time.time()
+        start = time.perf_counter()
+        try:
+            return self._call_ubus(
+                module, action, source, chunk_size or self.multipart_chunk_size
+            )
+        finally:
+            perf.REQUEST_LATENCIES.add((self.name, module, action), time.perf_counter() - start)
+            if trace_memory:
+                peak = tracemalloc.get_traced_memory()[1] - baseline
+                self.last_multipart_stats = self.last_multipart_stats._replace(peak_memory=peak)
+            if started_tracing:
+                tracemalloc.stop()
+
+    def ensure_connected(self, reconnect: bool = False):
+        """ Connects to ubus unless already connected
+
+        :param reconnect: drop the current connection first
+        """
         import ubus
 
+        if reconnect:
+            self.reconnect_count += 1
+            try:
+                ubus.disconnect()
+            except Exception:
+                pass
+
         if not ubus.get_connected():
-            wait_for_file(UBUS_PATH)
+            if not self.connect_count:
+                wait_for_file(UBUS_PATH)
             ubus.connect(UBUS_PATH)
+            self.connect_count += 1
 
-        module = "foris-controller-%s" % data.get("module", "?")
-        _wait_for_ubus_module(module, UBUS_PATH)
-        function = data.get("action", "?")
-        inner_data = data.get("data", None)
-        dumped_data = json.dumps(inner_data)
+    def wait_for_module(self, module: str):
+        """ Waits till the ubus object appears (only once per infrastructure) """
+        if module not in self._ready_modules:
+            _wait_for_ubus_module(module, UBUS_PATH)
+            self._ready_modules.add(module)
+
+    def _call_ubus(self, module_name: str, function: str, source: typing.Any, chunk_size: int):
+        import ubus
+
+        self.ensure_connected()
+        chunk_times = []
+        try:
+            return self._call_ubus_once(module_name, function, source, chunk_size, chunk_times)
+        except RuntimeError:  # failed ubus call
+            # The request is sent again only when the connection is gone (e.g. dropped
+            # by a notification sender). Other failures (e.g. a timeout) could have been
+            # processed by foris-controller, and a multipart request can't be resumed
+            # once some of its chunks were sent.
+            if ubus.get_connected() or chunk_times or _is_json_stream(source):
+                raise
+            self.ensure_connected(reconnect=True)
+            return self._call_ubus_once(module_name, function, source, chunk_size, [])
+
+    def _call_ubus_once(
+        self,
+        module_name: str,
+        function: str,
+        source: typing.Any,
+        chunk_size: int,
+        chunk_times: typing.List[float],
+    ):
+        """ Sends the request via the current ubus connection
+
+        :param chunk_times: durations of the sent multipart chunks are appended here
+        """
+        import ubus
+
+        module = "foris-controller-%s" % module_name
+        self.wait_for_module(module)
         request_id = str(uuid.uuid4())
-        if len(dumped_data) > 512 * 1024:
-            for data_part in Infrastructure.chunks(dumped_data, 512 * 1024):
+        size = 0
+
+        chunks = iter_json_chunks(source, chunk_size)
+        first = next(chunks, None)
+        second = next(chunks, None)
+        if second is not None:
+            for data_part in itertools.chain([first, second], chunks):
+                chunk_start = time.perf_counter()
                 ubus.call(
                     module,
                     function,
@@ -407,6 +946,11 @@ class UbusInfrastructure(Infrastructure):
                         "request_id": request_id,
                     },
                 )
+                chunk_times.append(time.perf_counter() - chunk_start)
+                perf.MULTIPART_CHUNK_LATENCIES.add(
+                    (self.name, module_name, function), chunk_times[-1]
+                )
+                size += len(data_part)
 
             res = ubus.call(
                 module,
@@ -420,6 +964,10 @@ class UbusInfrastructure(Infrastructure):
             )
 
         else:
+            if _is_json_stream(source):
+                inner_data = json.loads(first) if first else None
+            else:
+                inner_data = source
             res = ubus.call(
                 module,
                 function,
@@ -431,7 +979,8 @@ class UbusInfrastructure(Infrastructure):
                 },
             )
 
-        ubus.disconnect()
+        self.last_multipart_stats = MultipartStats(len(chunk_times), size, tuple(chunk_times))
+        data = {"module": module_name, "action": function}
         resp = json.loads("".join([e["data"] for e in res]))
         if "errors" in resp:
             return {
@@ -452,10 +1001,9 @@ class UbusInfrastructure(Infrastructure):
     def process_message_ubus_raw(self, data, request_id, final, multipart, multipart_data):
         import ubus
 
-        if not ubus.get_connected():
-            ubus.connect(UBUS_PATH)
+        self.ensure_connected()
         module = "foris-controller-%s" % data.get("module", "?")
-        _wait_for_ubus_module(data.get("module", "?"), UBUS_PATH)
+        self.wait_for_module(module)
         function = data.get("action", "?")
         payload = {}
         if data is not None:
@@ -487,9 +1035,14 @@ class UbusInfrastructure(Infrastructure):
         return {"module": data["module"], "action": data["action"], "kind": "reply"}
 
     def start_message_bus(self):
-        self.ubusd_instance = subprocess.Popen(["ubusd", "-s", UBUS_PATH])
+        self.ubusd_instance = subprocess.Popen(
+            ["ubusd", "-s", UBUS_PATH], **self.profile_kwargs(bus=True)
+        )
         wait_for_file(UBUS_PATH)
 
+    def bus_pid(self) -> typing.Optional[int]:
+        return self.ubusd_instance.pid
+
     def terminate_message_bus(self):
         self.ubusd_instance.kill()
         try:
@@ -512,26 +1065,15 @@ class UnixSocketInfrastructure(Infrastructure):
     def bus_options(self) -> typing.List[str]:
         return ["--path", SOCK_PATH, "--notifications-path", NOTIFICATION_SOCK_PATH]
 
-    def make_listener(self):
-        self.listener = Process(target=unix_notification_listener, args=tuple())
-        self.listener.start()
+    def listener_args(self) -> tuple:
+        return (NOTIFICATION_SOCK_PATH,)
 
-    def process_message(self, data):
+    def _process_message(self, data):
         wait_for_file(SOCK_PATH)
-        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        sock.connect(SOCK_PATH)
-        data = json.dumps(data).encode("utf8")
-        length_bytes = struct.pack("I", len(data))
-        sock.sendall(length_bytes + data)
-
-        length = struct.unpack("I", sock.recv(4))[0]
-        received = sock.recv(length)
-        recv_len = len(received)
-        while recv_len < length:
-            received += sock.recv(length)
-            recv_len = len(received)
-
-        return json.loads(received.decode("utf8"))
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(SOCK_PATH)
+            send_frame(sock, encode_message(data))
+            return recv_frame(sock)
 
     def start_message_bus(self):
         pass  # unix-socket doesn't use any message bus
@@ -540,44 +1082,77 @@ class UnixSocketInfrastructure(Infrastructure):
         pass  # unix-socket doesn't use any message bus
 
 
-def ubus_notification_listener(exiting):
-    import prctl
-    import signal
+INFRASTRUCTURE_CLASSES = {
+    e.name: e for e in (MqttInfrastructure, UbusInfrastructure, UnixSocketInfrastructure)
+}
 
-    prctl.set_pdeathsig(signal.SIGKILL)
-    import ubus
 
-    if ubus.get_connected():
-        ubus.disconnect(False)
+@contextlib.contextmanager
+def notification_api(infrastructure: Infrastructure, extra_module_paths: typing.List[str]):
+    """ Yields a function which sends notifications on the infrastructure's bus
+        (the same way foris-controller modules do)
 
-    wait_for_file(UBUS_PATH)
-    ubus.connect(UBUS_PATH)
-    global notifications_lock
+    :param infrastructure: running infrastructure
+    :param extra_module_paths: paths to foris-controller modules (to validate notifications)
+    """
+    if infrastructure.name == "ubus":
+        from foris_controller.buses.ubus import UbusNotificationSender
+
+        sender = UbusNotificationSender(infrastructure.notification_sock_path)
+
+    elif infrastructure.name == "unix-socket":
+        from foris_controller.buses.unix_socket import UnixSocketNotificationSender
+
+        sender = UnixSocketNotificationSender(infrastructure.notification_sock_path)
+
+    elif infrastructure.name == "mqtt":
+        from foris_controller.buses.mqtt import MqttNotificationSender
+
+        sender = MqttNotificationSender(MQTT_HOST, MQTT_PORT, None)
+
+    def notify(module, action, notification=None, validate=True):
+        if validate:
+            validator = validation.get_validator([module], extra_module_paths)
+        else:
+            validator = None
+        sent = time.time()
+        sender.notify(module, action, notification, validator)
+        infrastructure.note_notification_sent(module, action, sent)
 
     try:
-        os.unlink(NOTIFICATIONS_OUTPUT_PATH)
-    except OSError:
-        if os.path.exists(NOTIFICATIONS_OUTPUT_PATH):
-            raise
+        yield notify
+    finally:
+        sender.disconnect()
 
-    with open(NOTIFICATIONS_OUTPUT_PATH, "w") as f:
-        f.flush()
 
-        def handler(module, data):
-            module_name = module[len("foris-controller-") :]
-            msg = {"module": module_name, "kind": "notification", "action": data["action"]}
-            if "data" in data:
-                msg["data"] = data["data"]
+def _deprecated_listener(name: str):
+    warnings.warn(
+        f"'{name}' is deprecated, use listener.run_listener instead. "
+        "Note that this function will be removed in the future",
+        DeprecationWarning,
+    )
 
-            with notifications_lock:
-                f.write(json.dumps(msg) + "\n")
-                f.flush()
 
-        ubus.listen(("foris-controller-*", handler))
-        while True:
-            ubus.loop(200)
-            if exiting.value:
-                break
+def ubus_notification_listener(exiting):
+    """ Deprecated, see listener.run_listener """
+    _deprecated_listener("ubus_notification_listener")
+    listener.run_listener(
+        "ubus", None, NOTIFICATIONS_OUTPUT_PATH, notifications_lock, UBUS_PATH, exiting=exiting
+    )
+
+
+def mqtt_notification_listener(host, port):
+    """ Deprecated, see listener.run_listener """
+    _deprecated_listener("mqtt_notification_listener")
+    listener.run_listener("mqtt", None, NOTIFICATIONS_OUTPUT_PATH, notifications_lock, host, port)
+
+
+def unix_notification_listener():
+    """ Deprecated, see listener.run_listener """
+    _deprecated_listener("unix_notification_listener")
+    listener.run_listener(
+        "unix-socket", None, NOTIFICATIONS_OUTPUT_PATH, notifications_lock, NOTIFICATION_SOCK_PATH
+    )
 
 
 def wait_for_file(path, timeout=10.0):
@@ -599,96 +1174,3 @@ def wait_mqtt_client_connected(client: mqtt.Client, host: str, port: int, timeou
             if time.monotonic() > timeout + start_time:
                 raise
             time.sleep(0.1)  # Socket may not be created yet
-
-
-def mqtt_notification_listener(host, port):
-    import prctl
-    import signal
-
-    prctl.set_pdeathsig(signal.SIGKILL)
-    import ubus
-
-    global notifications_lock
-
-    try:
-        os.unlink(NOTIFICATIONS_OUTPUT_PATH)
-    except OSError:
-        if os.path.exists(NOTIFICATIONS_OUTPUT_PATH):
-            raise
-
-    with open(NOTIFICATIONS_OUTPUT_PATH, "w") as f:
-        f.flush()
-
-        def on_connect(client, userdata, flags, rc):
-            client.subscribe(
-                "foris-controller/%s/notification/+/action/+"
-                % os.environ.get("TEST_CLIENT_ID", "+")
-            )
-
-        def on_message(client, userdata, msg):
-            try:
-                parsed = json.loads(msg.payload)
-            except Exception:
-                return
-
-            match = re.match(
-                r"^foris-controller/[^/]+/notification/([^/]+)/action/([^/]+)$", msg.topic
-            )
-
-            if match:
-                module, action = match.group(1, 2)
-                msg = {"module": module, "action": action, "kind": "notification"}
-                if "data" in parsed:
-                    msg["data"] = parsed["data"]
-                with notifications_lock:
-                    f.write(json.dumps(msg) + "\n")
-                    f.flush()
-
-        client = mqtt.Client(**mqtt_client_extra())
-        client.on_connect = on_connect
-        client.on_message = on_message
-        wait_mqtt_client_connected(client, host, port)
-        client.loop_forever()
-
-
-def unix_notification_listener():
-    import prctl
-    import signal
-    from threading import Lock
-
-    lock = Lock()
-    prctl.set_pdeathsig(signal.SIGKILL)
-    global notifications_lock
-
-    try:
-        os.unlink(NOTIFICATION_SOCK_PATH)
-    except OSError:
-        if os.path.exists(NOTIFICATION_SOCK_PATH):
-            raise
-    try:
-        os.unlink(NOTIFICATIONS_OUTPUT_PATH)
-    except OSError:
-        if os.path.exists(NOTIFICATIONS_OUTPUT_PATH):
-            raise
-
-    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
-        pass
-
-    with open(NOTIFICATIONS_OUTPUT_PATH, "wb") as f:
-        f.flush()
-
-        class Handler(socketserver.StreamRequestHandler):
-            def handle(self):
-                while True:
-                    length_raw = self.rfile.read(4)
-                    if len(length_raw) != 4:
-                        break
-                    length = struct.unpack("I", length_raw)[0]
-                    data = self.rfile.read(length)
-                    with lock:
-                        with notifications_lock:
-                            f.write(data + b"\n")
-                            f.flush()
-
-        server = Server(NOTIFICATION_SOCK_PATH, Handler)
-        server.serve_forever()
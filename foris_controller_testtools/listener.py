@@ -0,0 +1,518 @@
+#
+# foris-controller-testtools
+# Copyright (C) 2026 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" Notification listener which runs in a separate process
+
+    A single thread waits (selectors) for the bus and for the control connection
+    of the test process. Received notifications are kept in memory and written
+    to the output file when the test process asks for them, or at latest
+    FLUSH_INTERVAL after they were received (for readers of the file which don't
+    use the control connection):
+
+        (seq, "flush", wait) -> (seq, "flushed", count)  # wait = max seconds to wait
+        (seq, "filters", [(module, action), ...] or None) -> (seq, "filtered", dropped count)
+        (seq, "rotate") -> (seq, "rotated", segment)  # output is truncated, a new segment starts
+        (seq, "exit") -> (seq, "exited", count)
+
+    Each reply carries the sequence number of its request, so the test process can
+    discard late replies of requests which it stopped waiting for.
+
+    "rotate" affects only the notifications received before the command arrived,
+    notifications still in flight on the bus are recorded into the new segment.
+
+    When filters are set only the matching notifications are recorded
+    (action None matches all actions of the module).
+"""
+
+import contextlib
+import json
+import os
+import re
+import select
+import selectors
+import socket
+import struct
+import time
+import typing
+
+# listeners store the time when the notification was received under this key
+NOTIFICATION_META_KEY = "_testtools"
+
+Filters = typing.Optional[typing.Set[typing.Tuple[str, typing.Optional[str]]]]
+
+MAX_PENDING = 10000  # flush even when nobody asks to keep the memory bounded
+UBUS_LOOP_SLICE = 20  # ms, python ubus bindings don't expose a file descriptor to wait on
+MISC_INTERVAL = 1.0  # how often the source housekeeping is performed (e.g. mqtt keepalive)
+FLUSH_INTERVAL = 0.1  # max time a received notification stays in memory
+SUBSCRIBE_TIMEOUT = 5.0  # how long a filter change waits for the broker's acknowledgement
+
+
+def _stamp_notification(msg: dict, seq: int) -> dict:
+    msg[NOTIFICATION_META_KEY] = {"received": time.time(), "seq": seq}
+    return msg
+
+
+class ListenerEngine:
+    def __init__(
+        self,
+        control,
+        output_path: str,
+        lock=None,
+        flush_interval: float = FLUSH_INTERVAL,
+        exiting=None,
+    ):
+        """
+        :param control: control connection, None = no control (notifications are written at once)
+        :param output_path: where the notifications are written (json per line)
+        :param lock: lock held while writing to the output
+        :param flush_interval: max time a received notification stays in memory
+        :param exiting: shared value (multiprocessing.Value) which stops the engine when set
+        """
+        self.control = control
+        self.output_path = output_path
+        self.lock = lock
+        self.flush_interval = flush_interval if control is not None else 0.0
+        self.exiting = exiting
+        self.selector = selectors.DefaultSelector()
+        if control is not None:
+            self.selector.register(control, selectors.EVENT_READ, self._on_control)
+        self.pending: typing.List[bytes] = []
+        self.flush_at: typing.Optional[float] = None  # when the pending notifications are written
+        self.waiting_until: typing.Optional[float] = None  # a reader waits for notifications
+        self.waiting_seq: typing.Optional[int] = None  # request of the waiting reader
+        self.exit_seq: typing.Optional[int] = None
+        self.running = True
+        self.filters: Filters = None
+        self.dropped = 0
+        self.segment = 0
+        self.seq = 0  # sequence number of the last notification (not reset by rotation)
+        self.source: typing.Optional[Source] = None
+
+        try:
+            os.unlink(output_path)
+        except FileNotFoundError:
+            pass
+        self.output = open(output_path, "wb")
+
+    def register(self, fileobj, callback: typing.Callable):
+        self.selector.register(fileobj, selectors.EVENT_READ, callback)
+
+    def unregister(self, fileobj):
+        self.selector.unregister(fileobj)
+
+    def accepts(self, module: str, action: str) -> bool:
+        if self.filters is None:
+            return True
+        return (module, action) in self.filters or (module, None) in self.filters
+
+    def add(self, msg: dict):
+        if not self.accepts(msg.get("module"), msg.get("action")):
+            self.dropped += 1
+            return
+        self.seq += 1
+        self.pending.append(json.dumps(_stamp_notification(msg, self.seq)).encode("utf8") + b"\n")
+        if self.waiting_until is not None:
+            self._flushed()
+        elif len(self.pending) >= MAX_PENDING or self.flush_interval <= 0:
+            self.flush()
+        elif self.flush_at is None:
+            self.flush_at = time.monotonic() + self.flush_interval
+
+    def flush(self) -> int:
+        self.flush_at = None
+        count = len(self.pending)
+        if count:
+            with self.lock or contextlib.nullcontext():
+                self.output.write(b"".join(self.pending))
+                self.output.flush()
+            self.pending = []
+        return count
+
+    def _reply(self, seq: typing.Optional[int], name: str, value: typing.Any):
+        self.control.send((seq, name, value))
+
+    def _flushed(self):
+        """ Replies to the flush request which waits for notifications """
+        seq = self.waiting_seq
+        self.waiting_until = self.waiting_seq = None
+        self._reply(seq, "flushed", self.flush())
+
+    def _on_control(self, control):
+        try:
+            seq, command, *args = control.recv()
+        except EOFError:  # test process is gone
+            self.running = False
+            return
+
+        if command == "flush":
+            wait = args[0] if args else 0.0
+            if self.pending or wait <= 0:
+                self._reply(seq, "flushed", self.flush())
+            else:
+                # a previous waiting request (if any) was given up by the test process
+                self.waiting_until = time.monotonic() + wait
+                self.waiting_seq = seq
+        elif command == "filters":
+            self.filters = None if args[0] is None else {tuple(e) for e in args[0]}
+            self.source.set_filters(self.filters)
+            self._reply(seq, "filtered", self.dropped)
+        elif command == "rotate":
+            self.pending = []
+            with self.lock or contextlib.nullcontext():
+                self.output.seek(0)
+                self.output.truncate()
+            self.segment += 1
+            self._reply(seq, "rotated", self.segment)
+        elif command == "exit":
+            self.exit_seq = seq
+            self.running = False
+
+    def run(self, source: "Source"):
+        self.source = source
+        source.start(self)
+        next_misc = time.monotonic() + MISC_INTERVAL
+        try:
+            while self.running:
+                if self.exiting is not None and self.exiting.value:
+                    break
+                now = time.monotonic()
+                timeout = next_misc - now
+                if self.waiting_until is not None:
+                    timeout = min(timeout, self.waiting_until - now)
+                if self.flush_at is not None:
+                    timeout = min(timeout, self.flush_at - now)
+
+                if source.polled:
+                    source.poll(max(min(timeout, UBUS_LOOP_SLICE / 1000), 0))
+                    timeout = 0
+
+                for key, _ in self.selector.select(max(timeout, 0)):
+                    key.data(key.fileobj)
+
+                now = time.monotonic()
+                if now >= next_misc:
+                    source.misc()
+                    next_misc = now + MISC_INTERVAL
+                if self.waiting_until is not None and now >= self.waiting_until:
+                    self._flushed()
+                elif self.flush_at is not None and now >= self.flush_at:
+                    self.flush()
+        finally:
+            source.stop()
+            count = self.flush()
+            self.output.close()
+            if self.control is not None:
+                try:
+                    self._reply(self.exit_seq, "exited", count)
+                except (BrokenPipeError, OSError):
+                    pass
+
+
+class Source:
+    polled = False  # True when the source has no file descriptor and has to be polled
+
+    def start(self, engine: ListenerEngine):
+        pass
+
+    def poll(self, timeout: float):
+        pass
+
+    def misc(self):
+        pass
+
+    def set_filters(self, filters: Filters):
+        """ Sources which can filter notifications on the bus override this """
+
+    def stop(self):
+        pass
+
+
+class UnixSocketSource(Source):
+    """ Accepts framed notifications (see foris_controller.buses.unix_socket) """
+
+    HEADER = struct.Struct("I")
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self.buffers: typing.Dict[socket.socket, bytearray] = {}
+
+    def start(self, engine: ListenerEngine):
+        self.engine = engine
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        self.server.listen(16)
+        self.server.setblocking(False)
+        engine.register(self.server, self._accept)
+
+    def _accept(self, server: socket.socket):
+        try:
+            conn, _ = server.accept()
+        except BlockingIOError:
+            return
+        conn.setblocking(False)
+        self.buffers[conn] = bytearray()
+        self.engine.register(conn, self._read)
+
+    def _read(self, conn: socket.socket):
+        try:
+            data = conn.recv(256 * 1024)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._close(conn)
+            return
+
+        buffer = self.buffers[conn]
+        buffer += data
+        header_size = self.HEADER.size
+        while len(buffer) >= header_size:
+            length = self.HEADER.unpack_from(buffer)[0]
+            if len(buffer) < header_size + length:
+                break
+            frame = bytes(buffer[header_size : header_size + length])
+            del buffer[: header_size + length]
+            try:
+                msg = json.loads(frame)
+            except ValueError:  # malformed frame, following frames are still valid
+                continue
+            if isinstance(msg, dict):
+                self.engine.add(msg)
+
+    def _close(self, conn: socket.socket):
+        self.engine.unregister(conn)
+        del self.buffers[conn]
+        conn.close()
+
+    def stop(self):
+        for conn in list(self.buffers):
+            self._close(conn)
+        self.server.close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+
+class UbusSource(Source):
+    polled = True
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+
+    def start(self, engine: ListenerEngine):
+        import ubus
+        from .infrastructure import wait_for_file
+
+        if ubus.get_connected():
+            ubus.disconnect(False)
+
+        wait_for_file(self.socket_path)
+        ubus.connect(self.socket_path)
+
+        def handler(module, data):
+            module_name = module[len("foris-controller-") :]
+            if not engine.accepts(module_name, data["action"]):
+                engine.dropped += 1
+                return
+            msg = {"module": module_name, "kind": "notification", "action": data["action"]}
+            if "data" in data:
+                msg["data"] = data["data"]
+            engine.add(msg)
+
+        ubus.listen(("foris-controller-*", handler))
+
+    def poll(self, timeout: float):
+        import ubus
+
+        ubus.loop(max(int(timeout * 1000), 1))
+
+    def stop(self):
+        import ubus
+
+        try:
+            ubus.disconnect()
+        except Exception:
+            pass
+
+
+class MqttSource(Source):
+    """ paho client driven by the engine's loop (loop_read / loop_write / loop_misc)
+
+        When the connection is lost the client reconnects in misc()
+        and subscribes its topics again.
+    """
+
+    TOPIC_RE = re.compile(r"^foris-controller/[^/]+/notification/([^/]+)/action/([^/]+)$")
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.topics = [self._topic("+", "+")]
+        self.socket = None  # None while disconnected
+        self.pending_subscriptions: typing.Set[int] = set()  # message ids waiting for SUBACK
+
+    @staticmethod
+    def _topic(module: str, action: str) -> str:
+        client_id = os.environ.get("TEST_CLIENT_ID", "+")
+        return f"foris-controller/{client_id}/notification/{module}/action/{action}"
+
+    def start(self, engine: ListenerEngine):
+        from paho.mqtt import client as mqtt
+        from .infrastructure import mqtt_client_extra, wait_mqtt_client_connected
+
+        self.engine = engine
+
+        def on_connect(client, userdata, flags, rc):
+            client.subscribe([(e, 0) for e in self.topics])
+
+        def on_subscribe(client, userdata, mid, granted_qos):
+            self.pending_subscriptions.discard(mid)
+
+        def on_disconnect(client, userdata, rc):
+            if self.socket is not None:
+                engine.unregister(self.socket)
+                self.socket = None
+
+        def on_message(client, userdata, msg):
+            try:
+                parsed = json.loads(msg.payload)
+            except Exception:
+                return
+
+            match = self.TOPIC_RE.match(msg.topic)
+            if match:
+                module, action = match.group(1, 2)
+                msg = {"module": module, "action": action, "kind": "notification"}
+                if "data" in parsed:
+                    msg["data"] = parsed["data"]
+                engine.add(msg)
+
+        self.client = mqtt.Client(**mqtt_client_extra())
+        self.client.on_connect = on_connect
+        self.client.on_message = on_message
+        self.client.on_subscribe = on_subscribe
+        self.client.on_disconnect = on_disconnect
+        wait_mqtt_client_connected(self.client, self.host, self.port)
+        self._connected()
+
+    def _connected(self):
+        self.socket = self.client.socket()
+        self.engine.register(self.socket, self._read)
+        self._write()
+
+    def _read(self, sock):
+        self.client.loop_read()
+        self._write()
+
+    def _write(self):
+        while self.client.want_write():
+            if self.client.loop_write():
+                break
+
+    def misc(self):
+        if self.socket is None:
+            try:
+                self.client.reconnect()  # topics are subscribed in on_connect
+            except OSError:
+                return  # broker is not available, try again later
+            self._connected()
+            return
+        self.client.loop_misc()
+        self._write()
+
+    def _wait_for_subscription(self, mid: int):
+        """ Handles the traffic of the connection till the subscription is acknowledged """
+        from paho.mqtt import client as mqtt
+
+        deadline = time.monotonic() + SUBSCRIBE_TIMEOUT
+        self.pending_subscriptions.add(mid)
+        self._write()
+        while mid in self.pending_subscriptions and self.socket is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if select.select([self.socket], [], [], remaining)[0]:
+                if self.client.loop_read() != mqtt.MQTT_ERR_SUCCESS:
+                    break
+                self._write()
+        self.pending_subscriptions.discard(mid)
+
+    def set_filters(self, filters: Filters):
+        """ Changes the subscriptions, so the broker sends only the matching notifications
+
+            New topics are subscribed (and acknowledged by the broker) before the old ones
+            are unsubscribed, so no matching notification is missed during the change.
+        """
+        from paho.mqtt import client as mqtt
+
+        if filters is None:
+            topics = [self._topic("+", "+")]
+        else:
+            topics = sorted({self._topic(module, action or "+") for module, action in filters})
+        if topics == self.topics:
+            return
+        old_topics, self.topics = self.topics, topics
+        if self.socket is None:
+            return  # current topics are subscribed on reconnect
+
+        added = [e for e in topics if e not in old_topics]
+        if added:
+            rc, mid = self.client.subscribe([(e, 0) for e in added])
+            if rc == mqtt.MQTT_ERR_SUCCESS:
+                self._wait_for_subscription(mid)
+        removed = [e for e in old_topics if e not in topics]
+        if removed and self.socket is not None:
+            self.client.unsubscribe(removed)
+            self._write()
+
+    def stop(self):
+        try:
+            self.client.disconnect()
+            self._write()
+        except Exception:
+            pass
+
+
+SOURCES = {"mqtt": MqttSource, "ubus": UbusSource, "unix-socket": UnixSocketSource}
+
+
+def run_listener(bus: str, control, output_path: str, lock, *source_args, exiting=None):
+    """ Listener process entry point
+
+    :param bus: name of the bus (see SOURCES)
+    :param control: control connection (multiprocessing.Pipe end),
+                    None = notifications are written as soon as they are received
+    :param output_path: where the notifications are written (json per line)
+    :param lock: lock held while writing to the output
+    :param source_args: arguments of the source (e.g. socket path)
+    :param exiting: shared value (multiprocessing.Value) which stops the listener when set
+    """
+    import prctl
+    import signal
+
+    prctl.set_pdeathsig(signal.SIGKILL)
+
+    engine = ListenerEngine(control, output_path, lock, exiting=exiting)
+    engine.run(SOURCES[bus](*source_args))
@@ -0,0 +1,136 @@
+#
+# foris-controller-testtools
+# Copyright (C) 2026 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+import bisect
+import contextlib
+import heapq
+import json
+import typing
+
+from .listener import NOTIFICATION_META_KEY
+
+Key = typing.Tuple[str, str]
+
+
+class _Stream:
+    """ Notifications ordered by their sequence number """
+
+    def __init__(self):
+        self.seqs: typing.List[int] = []
+        self.messages: typing.List[dict] = []
+
+    def append(self, seq: int, msg: dict):
+        self.seqs.append(seq)
+        self.messages.append(msg)
+
+    def since(self, seq: int) -> typing.List[dict]:
+        return self.messages[bisect.bisect_right(self.seqs, seq) :]
+
+
+class NotificationIndex:
+    """ Notifications read from the listener's output indexed by (module, action)
+
+        The output is read incrementally (only the lines appended since the last read are parsed).
+        Each notification carries a sequence number assigned by the listener.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.offset = 0
+        self.all = _Stream()
+        self._by_key: typing.Dict[Key, _Stream] = {}
+        self._by_module: typing.Dict[str, _Stream] = {}
+
+    @property
+    def messages(self) -> typing.List[dict]:
+        return self.all.messages
+
+    @property
+    def last_seq(self) -> int:
+        """ Sequence number of the last notification (-1 if there is none) """
+        return self.all.seqs[-1] if self.all.seqs else -1
+
+    def read(self, path: str, lock=None) -> typing.List[typing.Tuple[dict, dict]]:
+        """ Reads new notifications from the file
+
+        :param path: output of the listener
+        :param lock: lock held by the listener while writing
+        :returns: new (notification, listener metadata) pairs
+        """
+        try:
+            with lock or contextlib.nullcontext(), open(path, "rb") as f:
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+
+        # skip the line which is not complete yet
+        data = data[: data.rfind(b"\n") + 1]
+        self.offset += len(data)
+
+        res = []
+        for line in data.splitlines():
+            msg = json.loads(line)
+            meta = msg.pop(NOTIFICATION_META_KEY, {})
+            self.add(msg, meta.get("seq", self.last_seq + 1))
+            res.append((msg, meta))
+        return res
+
+    def add(self, msg: dict, seq: int):
+        self.all.append(seq, msg)
+        module, action = msg.get("module"), msg.get("action")
+        self._by_key.setdefault((module, action), _Stream()).append(seq, msg)
+        self._by_module.setdefault(module, _Stream()).append(seq, msg)
+
+    def _stream(self, module: typing.Optional[str], action: typing.Optional[str]) -> _Stream:
+        if module is None:
+            if action is not None:
+                raise ValueError("action can't be used without module")
+            return self.all
+        if action is None:
+            return self._by_module.get(module, _Stream())
+        return self._by_key.get((module, action), _Stream())
+
+    def notifications_since(
+        self, seq: int, module: typing.Optional[str] = None, action: typing.Optional[str] = None
+    ) -> typing.List[dict]:
+        """ Returns notifications with sequence number greater than seq (O(log n + k))
+
+        :param seq: sequence number (see last_seq), -1 returns all notifications
+        :param module: only notifications of the module
+        :param action: only notifications of the action (requires module)
+        """
+        return self._stream(module, action).since(seq)
+
+    def last(
+        self, module: typing.Optional[str] = None, action: typing.Optional[str] = None
+    ) -> typing.Optional[dict]:
+        """ Returns the last notification (of the module / action) or None """
+        stream = self._stream(module, action)
+        return stream.messages[-1] if stream.messages else None
+
+    def select(self, keys: typing.Iterable[Key]) -> typing.List[dict]:
+        """ Returns notifications matching any of (module, action) pairs ordered by seq """
+        streams = [self._by_key[e] for e in set(map(tuple, keys)) if e in self._by_key]
+        if len(streams) == 1:
+            return list(streams[0].messages)
+        merged = heapq.merge(*[zip(e.seqs, e.messages) for e in streams], key=lambda e: e[0])
+        return [msg for _, msg in merged]
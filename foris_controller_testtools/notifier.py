@@ -0,0 +1,208 @@
+#
+# foris-controller-testtools
+# Copyright (C) 2026 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" Long-running replacement of foris-notify
+
+    Accepts the same bus arguments as foris-notify, but instead of sending a single notification
+    it reads notifications from stdin (one JSON object per line):
+
+        {"module": "web", "action": "set_language", "data": {...}, "validate": true}
+
+    and for each of them writes a reply line to stdout:
+
+        {"retcode": 0, "stdout": "", "stderr": "", "sent": 1700000000.0}
+
+    where "sent" is time.time() taken right before the notification was sent
+    (null when it failed before it was sent).
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import typing
+
+from . import validation
+from .exceptions import NotifierError
+from .infrastructure import MQTT_HOST, MQTT_PORT
+
+Notification = typing.Union[
+    typing.Tuple[str, str, typing.Any], typing.Tuple[str, str, typing.Any, bool]
+]
+NotifyResult = typing.Tuple[int, bytes, bytes]  # same as the result of notify_cmd
+
+
+def bus_arguments(infrastructure) -> typing.List[str]:
+    """ foris-notify arguments which select the infrastructure's bus """
+    if infrastructure.name in ["ubus", "unix-socket"]:
+        return [infrastructure.name, "--path", infrastructure.notification_sock_path]
+    elif infrastructure.name in ["mqtt"]:
+        return [infrastructure.name, "--host", MQTT_HOST, "--port", str(MQTT_PORT)]
+    return []
+
+
+class NotifierProcess:
+    """ Client of the notifier process (see notify_batch fixture) """
+
+    def __init__(self, infrastructure, extra_module_paths: typing.List[str] = []):
+        self.infrastructure = infrastructure
+        extra_paths = []
+        for path in extra_module_paths:
+            extra_paths.extend(["--extra-module-path", path])
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", __name__] + extra_paths + bus_arguments(infrastructure),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        self.lock = threading.Lock()
+
+    def notify(
+        self, notifications: typing.Sequence[Notification], validate: bool = True
+    ) -> typing.List[NotifyResult]:
+        """ Sends notifications
+
+        :param notifications: (module, action, data) or (module, action, data, validate)
+        :param validate: validate notifications which don't specify it
+        :returns: (retcode, stdout, stderr) for each notification
+        """
+        lines = []
+        for notification in notifications:
+            module, action, data = notification[:3]
+            item_validate = notification[3] if len(notification) > 3 else validate
+            lines.append(
+                json.dumps(
+                    {"module": module, "action": action, "data": data, "validate": item_validate}
+                )
+                + "\n"
+            )
+
+        with self.lock:
+            # writing in a thread prevents deadlock when both pipes get full
+            writer = threading.Thread(target=self._write, args=(lines,), daemon=True)
+            writer.start()
+            res = []
+            sent_times = []
+            for _ in lines:
+                line = self.process.stdout.readline()
+                if not line:
+                    raise NotifierError(f"notifier exited (retcode={self.process.poll()})")
+                reply = json.loads(line)
+                res.append(
+                    (reply["retcode"], reply["stdout"].encode(), reply["stderr"].encode())
+                )
+                sent_times.append(reply.get("sent"))
+            writer.join()
+            for (module, action, *_), (retcode, _, _), sent in zip(notifications, res, sent_times):
+                if retcode == 0 and sent is not None:
+                    self.infrastructure.note_notification_sent(module, action, sent)
+        return res
+
+    def _write(self, lines: typing.List[str]):
+        try:
+            self.process.stdin.write("".join(lines))
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            pass  # detected by the reader
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        try:
+            self.process.wait(5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()
+
+    def __enter__(self) -> "NotifierProcess":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _make_sender(options: argparse.Namespace):
+    if options.bus == "ubus":
+        from foris_controller.buses.ubus import UbusNotificationSender
+
+        return UbusNotificationSender(options.path)
+
+    elif options.bus == "unix-socket":
+        from foris_controller.buses.unix_socket import UnixSocketNotificationSender
+
+        return UnixSocketNotificationSender(options.path)
+
+    elif options.bus == "mqtt":
+        from foris_controller.buses.mqtt import MqttNotificationSender
+
+        return MqttNotificationSender(options.host, options.port, options.passwd_file)
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m foris_controller_testtools.notifier")
+    parser.add_argument(
+        "--extra-module-path", dest="extra_module_paths", action="append", default=[]
+    )
+    subparsers = parser.add_subparsers(dest="bus", required=True)
+    ubus_parser = subparsers.add_parser("ubus")
+    ubus_parser.add_argument("--path", default="/var/run/ubus.sock")
+    unix_parser = subparsers.add_parser("unix-socket")
+    unix_parser.add_argument("--path", default="/tmp/foris-controller-notifications.soc")
+    mqtt_parser = subparsers.add_parser("mqtt")
+    mqtt_parser.add_argument("--host", default="localhost")
+    mqtt_parser.add_argument("--port", type=int, default=1883)
+    mqtt_parser.add_argument("--passwd-file", default=None)
+    options = parser.parse_args(argv)
+
+    # keep stdout clean for the replies
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    sender = _make_sender(options)
+    try:
+        for line in sys.stdin:
+            sent = None
+            try:
+                notification = json.loads(line)
+                module = notification["module"]
+                validator = None
+                if notification.get("validate", True):
+                    validator = validation.get_validator([module], options.extra_module_paths)
+                sent = time.time()
+                sender.notify(module, notification["action"], notification.get("data"), validator)
+                reply = {"retcode": 0, "stdout": "", "stderr": "", "sent": sent}
+            except Exception as exc:
+                stderr = "".join(traceback.format_exception_only(type(exc), exc))
+                reply = {"retcode": 1, "stdout": "", "stderr": stderr, "sent": sent}
+            replies.write(json.dumps(reply) + "\n")
+            replies.flush()
+    finally:
+        sender.disconnect()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+#
+# foris-controller-testtools
+# Copyright (C) 2026 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+import json
+import math
+import threading
+import time
+import typing
+
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyHistogram:
+    """ Log-scale histogram of durations
+
+        Each bucket is GROWTH times wider than the previous one, so percentiles
+        are estimated with ~1 % relative error using constant memory.
+    """
+
+    RESOLUTION = 1e-6  # the first bucket (in seconds)
+    GROWTH = 1.02
+
+    def __init__(self):
+        self.buckets: typing.Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = 0.0
+
+    def add(self, seconds: float):
+        bucket = int(math.log(max(seconds, self.RESOLUTION) / self.RESOLUTION, self.GROWTH))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.minimum = min(self.minimum, seconds)
+        self.maximum = max(self.maximum, seconds)
+
+    def merge(self, other: "LatencyHistogram"):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, percent: float) -> float:
+        if not self.count:
+            return 0.0
+        threshold = self.count * percent / 100.0
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= threshold:
+                value = self.RESOLUTION * self.GROWTH ** (bucket + 0.5)
+                return min(max(value, self.minimum), self.maximum)
+        return self.maximum
+
+    def to_dict(self) -> dict:
+        res = {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.mean,
+            "min": self.minimum if self.count else 0.0,
+            "max": self.maximum,
+        }
+        for percent in PERCENTILES:
+            res["p%d" % percent] = self.percentile(percent)
+        return res
+
+
+class LatencyRegistry:
+    """ Histograms keyed by a tuple (e.g. (bus, module, action)) """
+
+    def __init__(self, key_names: typing.Sequence[str]):
+        self.key_names = tuple(key_names)
+        self.lock = threading.Lock()
+        self.histograms: typing.Dict[tuple, LatencyHistogram] = {}
+
+    def add(self, key: tuple, seconds: float):
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.add(seconds)
+
+    def clear(self):
+        with self.lock:
+            self.histograms = {}
+
+    def __bool__(self) -> bool:
+        return bool(self.histograms)
+
+    def items(
+        self, top: typing.Optional[int] = None
+    ) -> typing.List[typing.Tuple[tuple, LatencyHistogram]]:
+        """ Returns (key, histogram) pairs ordered by key
+
+        :param top: only this many histograms with the largest total time (ordered by it)
+        """
+        with self.lock:
+            items = list(self.histograms.items())
+        if top is not None:
+            items.sort(key=lambda e: e[1].total, reverse=True)
+            return items[:top]
+        return sorted(items, key=lambda e: tuple(str(i) for i in e[0]))
+
+    def to_json(self, top: typing.Optional[int] = None) -> typing.List[dict]:
+        res = []
+        for key, histogram in self.items(top):
+            record = dict(zip(self.key_names, key))
+            record.update(histogram.to_dict())
+            res.append(record)
+        return res
+
+    def format_table(self, top: typing.Optional[int] = None) -> typing.List[str]:
+        """ Returns lines of a table with percentiles in milliseconds
+
+        :param top: show only the histograms with the largest total time (see items())
+        """
+        headers = list(self.key_names) + ["count"] + ["p%d" % e for e in PERCENTILES] + ["max"]
+        if top is not None:
+            headers.append("total")
+        rows = []
+        for key, histogram in self.items(top):
+            row = (
+                [str(e) for e in key]
+                + [str(histogram.count)]
+                + ["%.2f" % (histogram.percentile(e) * 1000) for e in PERCENTILES]
+                + ["%.2f" % (histogram.maximum * 1000)]
+            )
+            if top is not None:
+                row.append("%.2f" % (histogram.total * 1000))
+            rows.append(row)
+
+        return format_columns(headers, rows)
+
+
+def format_columns(
+    headers: typing.List[str], rows: typing.List[typing.List[str]]
+) -> typing.List[str]:
+    """ Returns lines of a table with aligned columns """
+    widths = [max(len(row[i]) for row in [headers] + rows) for i in range(len(headers))]
+    return [
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in [headers] + rows
+    ]
+
+
+# foris-controller request round trips (see Infrastructure.process_message)
+REQUEST_LATENCIES = LatencyRegistry(("bus", "module", "action"))
+
+# notification delivery to the listener, measured since it was sent (notify_api / notify_cmd)
+# or since the last request in case of notifications sent by foris-controller
+NOTIFICATION_LATENCIES = LatencyRegistry(("bus", "origin", "module", "action"))
+
+# calls of ubus multipart chunks (see UbusInfrastructure.process_message_streamed)
+MULTIPART_CHUNK_LATENCIES = LatencyRegistry(("bus", "module", "action"))
+
+# schema validation of requests and replies (see --validate-messages)
+VALIDATION_LATENCIES = LatencyRegistry(("bus", "kind", "module", "action"))
+
+
+# setup and teardown of testtools fixtures (see FixtureTimer)
+FIXTURE_LATENCIES = LatencyRegistry(("fixture", "scope", "phase"))
+FIXTURE_TOP = 15  # fixtures shown in the test summary
+
+
+class FixtureTimer:
+    """ Measures setup and teardown of fixtures
+
+        Setup time doesn't contain setup of fixtures requested via request.getfixturevalue()
+        from the fixture's body (these are measured on their own).
+    """
+
+    def __init__(self, registry: LatencyRegistry):
+        self.registry = registry
+        self._setups: typing.List[typing.List[float]] = []  # [start, time of nested setups]
+        self._teardowns: typing.Dict[typing.Any, float] = {}  # fixturedef -> start
+
+    def setup_started(self):
+        self._setups.append([time.perf_counter(), 0.0])
+
+    def setup_finished(self, name: str, scope: str):
+        start, nested = self._setups.pop()
+        elapsed = time.perf_counter() - start
+        if self._setups:
+            self._setups[-1][1] += elapsed
+        self.registry.add((name, scope, "setup"), elapsed - nested)
+
+    def teardown_started(self, fixturedef):
+        self._teardowns[fixturedef] = time.perf_counter()
+
+    def teardown_finished(self, fixturedef, name: str, scope: str):
+        start = self._teardowns.pop(fixturedef, None)
+        if start is not None:
+            self.registry.add((name, scope, "teardown"), time.perf_counter() - start)
+
+
+FIXTURE_TIMER = FixtureTimer(FIXTURE_LATENCIES)
+
+
+def write_report(path: str, report: dict):
+    """ Stores machine-readable report of the test session """
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.flush()
@@ -0,0 +1,260 @@
+#
+# foris-controller-testtools
+# Copyright (C) 2026 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+""" Runs foris-controller under cProfile and / or tracemalloc
+
+        python -m foris_controller_testtools.profiler [--cprofile PATH] [--tracemalloc PATH] \\
+            -- <foris-controller arguments>
+
+    Stats are written when the controller exits (SIGTERM is turned into a regular exit).
+    Every thread of the controller gets its own profiler, the stats are merged on exit.
+"""
+
+import argparse
+import cProfile
+import os
+import pstats
+import signal
+import sys
+import threading
+import tracemalloc
+import typing
+
+from . import perf
+from .sandbox import sandbox_path
+
+CONTROLLER_PROFILE_DIR = sandbox_path("CONTROLLER_PROFILE_DIR")
+CONTROLLER_SCRIPT = "foris-controller"
+TRACEMALLOC_FRAMES = 1
+PROFILE_EXTENSION = ".prof"
+TRACEMALLOC_EXTENSION = ".tracemalloc"
+TOP_COUNT = 20
+
+# allocations of the interpreter machinery are not interesting
+TRACEMALLOC_FILTERS = [
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, cProfile.__file__),
+]
+
+
+def output_prefix(name: str) -> str:
+    """ Returns path (without extension) where the stats of a controller run are stored
+
+        Stats left by an earlier run of the same name are removed,
+        so they can't be taken for the stats of the new run.
+
+    :param name: name of the run (e.g. test module, bus and backend)
+    """
+    os.makedirs(CONTROLLER_PROFILE_DIR, exist_ok=True)
+    prefix = os.path.join(CONTROLLER_PROFILE_DIR, name.replace(os.sep, "_"))
+    for extension in (PROFILE_EXTENSION, TRACEMALLOC_EXTENSION):
+        try:
+            os.unlink(prefix + extension)
+        except FileNotFoundError:
+            pass
+    return prefix
+
+
+def wrapper_command(prefix: str, cprofile: bool, trace_memory: bool) -> typing.List[str]:
+    """ Returns the command which replaces `foris-controller` in the controller's argv
+
+    :param prefix: see output_prefix()
+    :param cprofile: run the controller under cProfile
+    :param trace_memory: run the controller with tracemalloc enabled
+    """
+    res = [sys.executable, "-m", __name__]
+    if cprofile:
+        res.extend(["--cprofile", prefix + PROFILE_EXTENSION])
+    if trace_memory:
+        res.extend(["--tracemalloc", prefix + TRACEMALLOC_EXTENSION])
+    return res + ["--"]
+
+
+def load_controller_main() -> typing.Callable:
+    """ Loads the console entry point of foris-controller """
+    from importlib.metadata import entry_points
+
+    points = entry_points()
+    if hasattr(points, "select"):
+        found = list(points.select(group="console_scripts", name=CONTROLLER_SCRIPT))
+    else:
+        found = [e for e in points.get("console_scripts", []) if e.name == CONTROLLER_SCRIPT]
+    if not found:
+        raise RuntimeError(f"entry point of '{CONTROLLER_SCRIPT}' was not found")
+    return found[0].load()
+
+
+class ThreadProfiles:
+    """ cProfile profiles only the thread which enabled it, so each thread gets its own """
+
+    def __init__(self):
+        self.main = cProfile.Profile()
+        self.threads: typing.List[cProfile.Profile] = []
+
+    def _start_thread(self, frame, event, arg):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()  # replaces this hook within the thread
+        except ValueError:
+            # python >= 3.12 allows only a single active profiler which covers all threads
+            sys.setprofile(None)
+            return
+        self.threads.append(profile)
+
+    def start(self):
+        threading.setprofile(self._start_thread)
+        self.main.enable()
+
+    def dump(self, path: str):
+        self.main.disable()
+        threading.setprofile(None)
+        pstats.Stats(self.main, *self.threads).dump_stats(path)
+
+
+def _terminate(signum, frame):
+    sys.exit(128 + signum)
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m foris_controller_testtools.profiler")
+    parser.add_argument("--cprofile", metavar="PATH", default=None)
+    parser.add_argument("--tracemalloc", metavar="PATH", default=None)
+    parser.add_argument("controller_args", nargs=argparse.REMAINDER)
+    options = parser.parse_args(argv)
+    controller_args = options.controller_args
+    if controller_args[:1] == ["--"]:
+        controller_args = controller_args[1:]
+
+    controller_main = load_controller_main()
+    sys.argv = [CONTROLLER_SCRIPT] + controller_args
+    signal.signal(signal.SIGTERM, _terminate)
+
+    profiles = ThreadProfiles() if options.cprofile else None
+    if options.tracemalloc:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    if profiles:
+        profiles.start()
+    try:
+        res = controller_main()
+    finally:
+        # memory snapshot goes first, so it doesn't contain the profiler's stats
+        if options.tracemalloc:
+            tracemalloc.take_snapshot().filter_traces(TRACEMALLOC_FILTERS).dump(
+                options.tracemalloc
+            )
+            tracemalloc.stop()
+        if profiles:
+            profiles.dump(options.cprofile)
+    return res or 0
+
+
+class ControllerProfiles:
+    """ Merges stats of all profiled controller runs of the test session """
+
+    def __init__(self):
+        self.runs: typing.List[str] = []
+        self.stats: typing.Optional[pstats.Stats] = None
+        # (file, line) -> [size, count]
+        self.allocations: typing.Dict[typing.Tuple[str, int], typing.List[int]] = {}
+
+    def add(self, prefix: str):
+        """ Loads the stats written by a controller run (see output_prefix) """
+        loaded = False
+        path = prefix + PROFILE_EXTENSION
+        if os.path.exists(path):
+            if self.stats is None:
+                self.stats = pstats.Stats(path)
+            else:
+                self.stats.add(path)
+            loaded = True
+
+        path = prefix + TRACEMALLOC_EXTENSION
+        if os.path.exists(path):
+            for stat in tracemalloc.Snapshot.load(path).statistics("lineno"):
+                frame = stat.traceback[0]
+                record = self.allocations.setdefault((frame.filename, frame.lineno), [0, 0])
+                record[0] += stat.size
+                record[1] += stat.count
+            loaded = True
+
+        if loaded:
+            self.runs.append(prefix)
+
+    def __bool__(self) -> bool:
+        return bool(self.runs)
+
+    def top_functions(self, count: int = TOP_COUNT) -> typing.List[dict]:
+        """ Functions which spent the most time in their own code """
+        if self.stats is None:
+            return []
+        items = sorted(self.stats.stats.items(), key=lambda e: e[1][2], reverse=True)[:count]
+        return [
+            {
+                "function": pstats.func_std_string(func),
+                "primitive_calls": primitive_calls,
+                "calls": calls,
+                "tottime": tottime,
+                "cumtime": cumtime,
+            }
+            for func, (primitive_calls, calls, tottime, cumtime, _) in items
+        ]
+
+    def top_allocations(self, count: int = TOP_COUNT) -> typing.List[dict]:
+        """ Lines which hold the most memory when the controllers exited """
+        items = sorted(self.allocations.items(), key=lambda e: e[1][0], reverse=True)[:count]
+        return [
+            {"line": "%s:%d" % location, "size": size, "count": allocations}
+            for location, (size, allocations) in items
+        ]
+
+    def format_functions(self, count: int = TOP_COUNT) -> typing.List[str]:
+        rows = [
+            [
+                "%d/%d" % (e["calls"], e["primitive_calls"]),
+                "%.3f" % e["tottime"],
+                "%.3f" % e["cumtime"],
+                e["function"],
+            ]
+            for e in self.top_functions(count)
+        ]
+        return perf.format_columns(["calls", "tottime", "cumtime", "function"], rows)
+
+    def format_allocations(self, count: int = TOP_COUNT) -> typing.List[str]:
+        rows = [
+            ["%.1f" % (e["size"] / 1024), str(e["count"]), e["line"]]
+            for e in self.top_allocations(count)
+        ]
+        return perf.format_columns(["KiB", "blocks", "line"], rows)
+
+    def to_dict(self, count: int = TOP_COUNT) -> dict:
+        return {
+            "runs": self.runs,
+            "functions": self.top_functions(count),
+            "allocations": self.top_allocations(count),
+        }
+
+
+CONTROLLER_PROFILES = ControllerProfiles()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
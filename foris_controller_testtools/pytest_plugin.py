@@ -1,6 +1,107 @@
+import shutil
+import tempfile
+
 import pytest  # noqa
 
 from .fixtures import *  # noqa
+from . import commands
+from . import perf
+from . import profiler
+from . import resources
+from . import sandbox
+from . import utils
+from . import validation
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("foris-controller-testtools")
+    group.addoption(
+        "--sandbox-root",
+        default=None,
+        help="directory where all mutable test state is placed (default: %s), paths imported "
+        "by conftests via 'from ... import' are not moved, use sandbox.sandbox_path() instead"
+        % sandbox.DEFAULT_SANDBOX_ROOT,
+    )
+    group.addoption(
+        "--sandbox-shm",
+        action="store_true",
+        default=False,
+        help="place the sandbox into a fresh RAM-backed directory within %s" % sandbox.SHM_ROOT,
+    )
+    group.addoption(
+        "--sandbox-checkpoint",
+        action="store_true",
+        default=False,
+        help="capture prepared sandbox paths once and restore only changed files between tests",
+    )
+    group.addoption(
+        "--command-shims",
+        action="store_true",
+        default=False,
+        help="faked commands report their calls to a collector socket owned by the test process",
+    )
+    group.addoption(
+        "--router-profile",
+        default=None,
+        choices=sorted(resources.ROUTER_PROFILES),
+        help="run foris-controller with CPU, memory and priority limits of a router",
+    )
+    group.addoption(
+        "--router-profile-buses",
+        action="store_true",
+        default=False,
+        help="apply --router-profile to message bus daemons as well",
+    )
+    group.addoption(
+        "--segment-notifications",
+        action="store_true",
+        default=False,
+        help="each test sees only notifications received since it started",
+    )
+    group.addoption(
+        "--validate-messages",
+        action="store_true",
+        default=False,
+        help="validate all requests and replies against the schemas of foris-controller modules",
+    )
+    group.addoption(
+        "--track-resources",
+        action="store_true",
+        default=False,
+        help="sample CPU, RSS, open fds and threads of the infrastructure processes around tests",
+    )
+    group.addoption(
+        "--resource-rss-threshold",
+        type=float,
+        default=8.0,
+        metavar="MiB",
+        help="with --track-resources flag tests which grow foris-controller RSS by more MiB",
+    )
+    group.addoption(
+        "--resource-fd-threshold",
+        type=int,
+        default=2,
+        metavar="COUNT",
+        help="with --track-resources flag tests which leave more new open fds in a process",
+    )
+    group.addoption(
+        "--profile-controller",
+        action="store_true",
+        default=False,
+        help="run foris-controller under cProfile, hottest functions are shown in the summary",
+    )
+    group.addoption(
+        "--trace-controller-memory",
+        action="store_true",
+        default=False,
+        help="run foris-controller with tracemalloc, top allocations are shown in the summary",
+    )
+    group.addoption(
+        "--perf-report",
+        default=None,
+        metavar="PATH",
+        help="write performance measurements of the test session to a JSON file",
+    )
 
 
 def pytest_configure(config):
@@ -16,3 +117,162 @@ def pytest_configure(config):
     config.addinivalue_line(
         "markers", "file_root_path(path): set path to mock file system root",
     )
+
+    config._testtools_shm_root = None
+    if config.getoption("--sandbox-shm"):
+        root = tempfile.mkdtemp(prefix="foris-controller-testtools-", dir=sandbox.SHM_ROOT)
+        config._testtools_shm_root = root
+        sandbox.set_sandbox_root(root)
+    elif config.getoption("--sandbox-root"):
+        sandbox.set_sandbox_root(config.getoption("--sandbox-root"))
+
+
+def pytest_unconfigure(config):
+    if getattr(config, "_testtools_shm_root", None):
+        shutil.rmtree(config._testtools_shm_root, ignore_errors=True)
+
+
+def pytest_report_header(config):
+    res = ["foris-controller-testtools sandbox: %s" % sandbox.get_sandbox_root()]
+    profile = config.getoption("--router-profile")
+    if profile:
+        res.append("foris-controller-testtools router profile: %s" % profile)
+    if config.getoption("--command-shims"):
+        # sh shims (with socat) are much faster than python ones
+        res.append("foris-controller-testtools command shims: %s" % commands.shim_kind())
+    return res
+
+
+def _is_testtools_fixture(fixturedef) -> bool:
+    module = getattr(fixturedef.func, "__module__", None) or ""
+    return module.split(".", 1)[0] == __name__.split(".", 1)[0]
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_fixture_setup(fixturedef, request):
+    if not _is_testtools_fixture(fixturedef):
+        yield
+        return
+
+    perf.FIXTURE_TIMER.setup_started()
+    try:
+        yield
+    finally:
+        perf.FIXTURE_TIMER.setup_finished(fixturedef.argname, fixturedef.scope)
+        # finalizers run in reverse order, so this one precedes the fixture's own teardown
+        fixturedef.addfinalizer(lambda: perf.FIXTURE_TIMER.teardown_started(fixturedef))
+
+
+def pytest_fixture_post_finalizer(fixturedef, request):
+    if _is_testtools_fixture(fixturedef):
+        perf.FIXTURE_TIMER.teardown_finished(fixturedef, fixturedef.argname, fixturedef.scope)
+
+
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    stats = utils.COPY_STATS
+    if stats.files:
+        terminalreporter.write_sep("-", "foris-controller-testtools copy stats")
+        terminalreporter.write_line(
+            "copied %d files (%.1f MiB) in %.3f s, %.1f MiB/s"
+            % (stats.files, stats.bytes / 2 ** 20, stats.seconds, stats.throughput / 2 ** 20)
+        )
+
+    if perf.REQUEST_LATENCIES:
+        terminalreporter.write_sep("-", "foris-controller-testtools request latency (ms)")
+        for line in perf.REQUEST_LATENCIES.format_table():
+            terminalreporter.write_line(line)
+
+    if perf.FIXTURE_LATENCIES:
+        terminalreporter.write_sep("-", "foris-controller-testtools fixture costs (ms)")
+        for line in perf.FIXTURE_LATENCIES.format_table(top=perf.FIXTURE_TOP):
+            terminalreporter.write_line(line)
+
+    if perf.NOTIFICATION_LATENCIES:
+        terminalreporter.write_sep("-", "foris-controller-testtools notification delivery (ms)")
+        for line in perf.NOTIFICATION_LATENCIES.format_table():
+            terminalreporter.write_line(line)
+
+    if perf.MULTIPART_CHUNK_LATENCIES:
+        terminalreporter.write_sep("-", "foris-controller-testtools ubus multipart chunks (ms)")
+        for line in perf.MULTIPART_CHUNK_LATENCIES.format_table():
+            terminalreporter.write_line(line)
+
+    if perf.VALIDATION_LATENCIES:
+        terminalreporter.write_sep("-", "foris-controller-testtools message validation (ms)")
+        for line in perf.VALIDATION_LATENCIES.format_table():
+            terminalreporter.write_line(line)
+
+    validators = validation.VALIDATORS
+    if validators.hits or validators.misses:
+        terminalreporter.write_sep("-", "foris-controller-testtools schema validators")
+        terminalreporter.write_line(
+            "%d validators compiled in %.3f s, cache hit rate %.1f %% (%d hits, %d misses)"
+            % (
+                validators.misses,
+                validators.compile_seconds,
+                validators.hit_rate * 100,
+                validators.hits,
+                validators.misses,
+            )
+        )
+
+    usage = resources.RESOURCE_USAGE
+    if usage:
+        terminalreporter.write_sep("-", "foris-controller-testtools process resources")
+        rows = [
+            [
+                role,
+                "%.3f" % totals["cpu_seconds"],
+                "%+.1f" % (totals["rss"] / resources.MiB),
+                "%+d" % totals["fds"],
+                "%+d" % totals["threads"],
+            ]
+            for role, totals in sorted(usage.totals.items())
+        ]
+        for line in perf.format_columns(["process", "cpu s", "rss MiB", "fds", "threads"], rows):
+            terminalreporter.write_line(line)
+        for test, reasons in usage.flagged:
+            terminalreporter.write_line("%s: %s" % (test, ", ".join(reasons)))
+
+    profiles = profiler.CONTROLLER_PROFILES
+    if profiles.stats is not None:
+        terminalreporter.write_sep("-", "foris-controller-testtools controller profile (s)")
+        for line in profiles.format_functions():
+            terminalreporter.write_line(line)
+    if profiles.allocations:
+        terminalreporter.write_sep("-", "foris-controller-testtools controller memory")
+        for line in profiles.format_allocations():
+            terminalreporter.write_line(line)
+    if profiles:
+        terminalreporter.write_line(
+            "stats of %d controller runs are stored in %s"
+            % (len(profiles.runs), profiler.CONTROLLER_PROFILE_DIR)
+        )
+
+    report_path = config.getoption("--perf-report")
+    if report_path:
+        perf.write_report(
+            report_path,
+            {
+                "router_profile": config.getoption("--router-profile"),
+                "command_shims": commands.shim_kind()
+                if config.getoption("--command-shims")
+                else None,
+                "sandbox_root": sandbox.get_sandbox_root(),
+                "copy": {
+                    "files": stats.files,
+                    "bytes": stats.bytes,
+                    "seconds": stats.seconds,
+                    "throughput": stats.throughput,
+                },
+                "requests": perf.REQUEST_LATENCIES.to_json(),
+                "fixtures": perf.FIXTURE_LATENCIES.to_json(),
+                "notifications": perf.NOTIFICATION_LATENCIES.to_json(),
+                "validators": validators.to_dict(),
+                "validation": perf.VALIDATION_LATENCIES.to_json(),
+                "multipart_chunks": perf.MULTIPART_CHUNK_LATENCIES.to_json(),
+                "process_resources": usage.to_dict(),
+                "controller_profile": profiles.to_dict(),
+            },
+        )
+        terminalreporter.write_line("performance report written to %s" % report_path)
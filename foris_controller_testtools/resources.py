@@ -0,0 +1,167 @@
+#
+# foris-controller-testtools
+# Copyright (C) 2026 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+import os
+import resource
+import typing
+
+MiB = 1024 * 1024
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+class RouterProfile(typing.NamedTuple):
+    name: str
+    cpus: int  # number of cores the process is pinned to
+    data_limit: int  # RLIMIT_DATA (bytes)
+    address_space_limit: int  # RLIMIT_AS (bytes), leaves room for thread stacks and arenas
+    nice: int  # priority decrement
+
+
+# Rough approximation of the memory a single process can use on the router
+ROUTER_PROFILES = {
+    "mox": RouterProfile(
+        "mox", cpus=1, data_limit=256 * MiB, address_space_limit=1024 * MiB, nice=10
+    ),
+    "omnia": RouterProfile(
+        "omnia", cpus=1, data_limit=512 * MiB, address_space_limit=2048 * MiB, nice=5
+    ),
+    "turris1x": RouterProfile(
+        "turris1x", cpus=1, data_limit=512 * MiB, address_space_limit=2048 * MiB, nice=10
+    ),
+}
+
+
+def router_profile_preexec(profile: RouterProfile) -> typing.Callable[[], None]:
+    """ Returns a function which applies the profile to the current process
+        (meant to be used as `preexec_fn` of subprocess.Popen)
+
+        The process is pinned to the last cores available to the test run,
+        so it doesn't compete with the tests for the first one.
+    """
+    cpus = set(sorted(os.sched_getaffinity(0))[-profile.cpus :])
+
+    def apply():
+        os.sched_setaffinity(0, cpus)
+        resource.setrlimit(resource.RLIMIT_DATA, (profile.data_limit, profile.data_limit))
+        resource.setrlimit(
+            resource.RLIMIT_AS, (profile.address_space_limit, profile.address_space_limit)
+        )
+        os.nice(profile.nice)
+
+    return apply
+
+
+class ProcessSample(typing.NamedTuple):
+    cpu_seconds: float  # user + system
+    rss: int  # bytes
+    fds: int
+    threads: int
+
+
+def sample_process(pid: int) -> typing.Optional[ProcessSample]:
+    """ Reads resource usage of a process from /proc
+
+    :param pid: process id
+    :returns: None when the process doesn't exist (anymore)
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+        fds = len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        return None
+
+    # process name may contain spaces, fields following it start with the state (3rd field)
+    fields = stat.rsplit(")", 1)[1].split()
+    return ProcessSample(
+        cpu_seconds=(int(fields[11]) + int(fields[12])) / CLOCK_TICKS,
+        rss=int(fields[21]) * PAGE_SIZE,
+        fds=fds,
+        threads=int(fields[17]),
+    )
+
+
+ProcessSamples = typing.Dict[str, typing.Tuple[int, ProcessSample]]  # role -> (pid, sample)
+
+
+def process_deltas(before: ProcessSamples, after: ProcessSamples) -> typing.Dict[str, dict]:
+    """ Differences between two samples of the same processes
+
+    :param before: samples taken at the start of the test
+    :param after: samples taken at the end of the test
+    :returns: role -> {"cpu_seconds": ..., "rss": ..., "fds": ..., "threads": ...}
+              (processes which were restarted or stopped meanwhile are omitted)
+    """
+    res = {}
+    for role, (pid, sample) in after.items():
+        if role not in before or before[role][0] != pid:
+            continue
+        res[role] = {
+            field: value - old for field, value, old in zip(sample._fields, sample, before[role][1])
+        }
+    return res
+
+
+class ResourceUsage:
+    """ Per-test resource deltas of the infrastructure processes (see --track-resources) """
+
+    def __init__(self):
+        self.tests = 0
+        self.totals: typing.Dict[str, typing.Dict[str, float]] = {}  # role -> summed deltas
+        self.flagged: typing.List[typing.Tuple[str, typing.List[str]]] = []  # (test, reasons)
+
+    def add(
+        self, test: str, deltas: typing.Dict[str, dict], rss_threshold: int, fd_threshold: int
+    ) -> typing.List[str]:
+        """ Records deltas of a test
+
+        :param test: test id
+        :param deltas: result of process_deltas()
+        :param rss_threshold: flag the test when controller RSS grows by more bytes
+        :param fd_threshold: flag the test when any process gets more new open fds
+        :returns: reasons why the test was flagged
+        """
+        self.tests += 1
+        reasons = []
+        for role, delta in sorted(deltas.items()):
+            totals = self.totals.setdefault(role, dict.fromkeys(delta, 0))
+            for field, value in delta.items():
+                totals[field] += value
+            if role == "controller" and delta["rss"] > rss_threshold:
+                reasons.append("controller RSS +%.1f MiB" % (delta["rss"] / MiB))
+            if delta["fds"] > fd_threshold:
+                reasons.append("%s fds +%d" % (role, delta["fds"]))
+
+        if reasons:
+            self.flagged.append((test, reasons))
+        return reasons
+
+    def __bool__(self) -> bool:
+        return self.tests > 0
+
+    def to_dict(self) -> dict:
+        return {
+            "tests": self.tests,
+            "totals": self.totals,
+            "flagged": [{"test": test, "reasons": reasons} for test, reasons in self.flagged],
+        }
+
+
+RESOURCE_USAGE = ResourceUsage()
@@ -0,0 +1,86 @@
+#
+# foris-controller-testtools
+# Copyright (C) 2026 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+import os
+import sys
+
+SANDBOX_ROOT_ENV = "FORIS_TESTTOOLS_SANDBOX_ROOT"
+DEFAULT_SANDBOX_ROOT = "/tmp"
+SHM_ROOT = "/dev/shm"
+
+# mutable test state which is placed under the sandbox root (constant name -> relative path)
+SANDBOX_PATHS = {
+    "UCI_CONFIG_DIR_PATH": "uci_configs",
+    "FILE_ROOT_PATH": "foris_files",
+    "REBOOT_INDICATOR_PATH": "device-reboot-required",
+    "INIT_SCRIPT_TEST_DIR": "test_init",
+    "SH_CALLED_FILE": "sh_called",
+    "GENERIC_CALLED_FILE": "command_called",
+    "REBOOT_CALLED_FILE": "reboot_called",
+    "NETWORK_RESTART_CALLED_FILE": "network_restart_called",
+    "LIGHTTPD_RESTART_CALLED_FILE": "lighttpd_restart_called",
+    "CALLS_LOG_PATH": "foris-controller-calls.log",
+    "TURRISHW_ROOT": "turrishw_root/",
+    "NOTIFICATIONS_OUTPUT_PATH": "foris-controller-notifications-test.json",
+    "RUNNING_FILE_PATH": "updater-running-mock",
+    "APPROVAL_FILE_PATH": "updater-approval-mock.json",
+    "AFTER_HOOK_INDICATOR": "updater-after-hook",
+    "LANGS_FILE_PATH": "updater-mock-l10n.json",
+    "LISTS_FILE_PATH": "updater-mock-lists.json",
+    "CONTROLLER_PROFILE_DIR": "controller-profiles",
+}
+
+
+def get_sandbox_root() -> str:
+    return os.environ.get(SANDBOX_ROOT_ENV, DEFAULT_SANDBOX_ROOT)
+
+
+def sandbox_path(name: str) -> str:
+    """ Returns a path of the sandboxed constant (see SANDBOX_PATHS)
+
+    :param name: name of the constant (e.g. "UCI_CONFIG_DIR_PATH")
+    :returns: path within the current sandbox root
+    """
+    return os.path.join(get_sandbox_root(), SANDBOX_PATHS[name])
+
+
+def set_sandbox_root(root: str):
+    """ Moves all the sandboxed paths under a new root
+
+        The root is exported via environment, so it is inherited by foris-controller
+        (and the svupdater mock running within it). Path constants of already imported
+        testtools modules are updated as well.
+
+        Copies of the constants made elsewhere (e.g. `from foris_controller_testtools.utils
+        import SH_CALLED_FILE` in a conftest) are not updated, such code should call
+        sandbox_path() or read the constant via its module when the path is used.
+
+    :param root: new sandbox root (created when missing)
+    """
+    root = os.path.abspath(root)
+    os.makedirs(root, exist_ok=True)
+    os.environ[SANDBOX_ROOT_ENV] = root
+
+    package = __name__.rsplit(".", 1)[0]
+    for module_name, module in list(sys.modules.items()):
+        if module is None or not (module_name == package or module_name.startswith(package + ".")):
+            continue
+        for name in SANDBOX_PATHS:
+            if name in vars(module):
+                setattr(module, name, sandbox_path(name))
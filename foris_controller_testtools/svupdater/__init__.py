@@ -24,8 +24,9 @@ import os
 import subprocess
 
 from .hook import register
+from ..sandbox import sandbox_path
 
-RUNNING_FILE_PATH = "/tmp/updater-running-mock"
+RUNNING_FILE_PATH = sandbox_path("RUNNING_FILE_PATH")
 
 
 def opkg_lock():
@@ -23,8 +23,9 @@ import json
 import typing
 
 from .exceptions import ExceptionUpdaterApproveInvalid
+from ..sandbox import sandbox_path
 
-APPROVAL_FILE_PATH = "/tmp/updater-approval-mock.json"
+APPROVAL_FILE_PATH = sandbox_path("APPROVAL_FILE_PATH")
 
 # Note: Keep these datatypes in sync with `svupdater.approvals`
 class PlannedPackage(typing.TypedDict):
@@ -18,7 +18,9 @@
 #
 
 
-AFTER_HOOK_INDICATOR = "/tmp/updater-after-hook"
+from ..sandbox import sandbox_path
+
+AFTER_HOOK_INDICATOR = sandbox_path("AFTER_HOOK_INDICATOR")
 
 
 def register(command):
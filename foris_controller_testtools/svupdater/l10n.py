@@ -19,7 +19,9 @@
 
 import json
 
-LANGS_FILE_PATH = "/tmp/updater-mock-l10n.json"
+from ..sandbox import sandbox_path
+
+LANGS_FILE_PATH = sandbox_path("LANGS_FILE_PATH")
 
 
 def languages():
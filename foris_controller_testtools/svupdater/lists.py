@@ -21,8 +21,9 @@
 import json
 import typing
 from .. import utils
+from ..sandbox import sandbox_path
 
-LISTS_FILE_PATH = "/tmp/updater-mock-lists.json"
+LISTS_FILE_PATH = sandbox_path("LISTS_FILE_PATH")
 __PKGLIST_ENTRIES_LABELS = typing.Dict[str, str]
 __PKGLIST_ENTRIES_OPTIONS = typing.Dict[str, typing.Union[str, bool, __PKGLIST_ENTRIES_LABELS]]
 __PKGLIST_ENTRIES = typing.Dict[
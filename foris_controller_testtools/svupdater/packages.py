@@ -19,7 +19,7 @@
 
 import json
 from pathlib import Path
-from ..utils import TURRISHW_ROOT
+from ..sandbox import sandbox_path
 
 
 class Status:
@@ -28,7 +28,12 @@ class Status:
         "foo-alternative": "foo"
     }
 
-    CUSTOM_FILE_PATH = Path(TURRISHW_ROOT) / "usr/lib/opkg/status.json"
+    CUSTOM_FILE = "usr/lib/opkg/status.json"  # relative to TURRISHW_ROOT
+
+    @classmethod
+    def custom_file_path(cls) -> Path:
+        # resolved at use time, so it follows the sandbox root
+        return Path(sandbox_path("TURRISHW_ROOT")) / cls.CUSTOM_FILE
 
     @classmethod
     def installed(cls, package):
@@ -47,8 +52,9 @@ class Status:
 
     @classmethod
     def _load_packages(cls):
-        if cls.CUSTOM_FILE_PATH.is_file():
-            with open(cls.CUSTOM_FILE_PATH, 'r') as f:
+        custom_file_path = cls.custom_file_path()
+        if custom_file_path.is_file():
+            with open(custom_file_path, 'r') as f:
                 data = json.load(f)
 
             installed = data["installed"]
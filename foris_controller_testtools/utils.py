@@ -18,6 +18,7 @@
 
 import json
 import multiprocessing
+import os
 import re
 import shutil
 import stat
@@ -26,20 +27,24 @@ import threading
 import time
 import typing
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from .exceptions import MockNotFoundError
+from .sandbox import sandbox_path
 from .svupdater import approvals as svupdater_approvals
 from .svupdater import l10n as svupdater_l10n
 from .svupdater import lists as svupdater_lists
 
-INIT_SCRIPT_TEST_DIR = "/tmp/test_init"
-SH_CALLED_FILE = "/tmp/sh_called"
-GENERIC_CALLED_FILE = "/tmp/command_called"
-REBOOT_CALLED_FILE = "/tmp/reboot_called"
-NETWORK_RESTART_CALLED_FILE = "/tmp/network_restart_called"
-LIGHTTPD_RESTART_CALLED_FILE = "/tmp/lighttpd_restart_called"
-TURRISHW_ROOT = "/tmp/turrishw_root/"
+INIT_SCRIPT_TEST_DIR = sandbox_path("INIT_SCRIPT_TEST_DIR")
+SH_CALLED_FILE = sandbox_path("SH_CALLED_FILE")
+GENERIC_CALLED_FILE = sandbox_path("GENERIC_CALLED_FILE")
+REBOOT_CALLED_FILE = sandbox_path("REBOOT_CALLED_FILE")
+NETWORK_RESTART_CALLED_FILE = sandbox_path("NETWORK_RESTART_CALLED_FILE")
+LIGHTTPD_RESTART_CALLED_FILE = sandbox_path("LIGHTTPD_RESTART_CALLED_FILE")
+TURRISHW_ROOT = sandbox_path("TURRISHW_ROOT")
+
+COPY_WORKERS = min(32, (os.cpu_count() or 1) * 4)
 
 
 def get_uci_module(lock_backend):
@@ -78,6 +83,150 @@ def match_subdict(expected_data: dict, obtained_data: dict) -> bool:
     return True
 
 
+class _Any:
+    def __repr__(self):
+        return "ANY"
+
+
+# matches any value (the key / item has to be present though)
+ANY = _Any()
+
+_Check = typing.Callable[[typing.Any], bool]
+
+
+def _compile_check(expected) -> _Check:
+    if expected is ANY:
+        return lambda obtained: True
+
+    if isinstance(expected, re.Pattern):
+        fullmatch = expected.fullmatch
+        return lambda obtained: isinstance(obtained, str) and fullmatch(obtained) is not None
+
+    if isinstance(expected, dict):
+        checks = [(key, _compile_check(value)) for key, value in expected.items()]
+
+        def check_dict(obtained) -> bool:
+            if not isinstance(obtained, dict):
+                return False
+            for key, check in checks:
+                if key not in obtained or not check(obtained[key]):
+                    return False
+            return True
+
+        return check_dict
+
+    if isinstance(expected, list):
+        checks = [_compile_check(e) for e in expected]
+
+        def check_list(obtained) -> bool:
+            if not isinstance(obtained, list) or len(obtained) != len(checks):
+                return False
+            for check, item in zip(checks, obtained):
+                if not check(item):
+                    return False
+            return True
+
+        return check_list
+
+    return lambda obtained: expected == obtained
+
+
+def _explain(expected, obtained, path: str) -> typing.Optional[str]:
+    if expected is ANY:
+        return None
+
+    if isinstance(expected, re.Pattern):
+        if isinstance(obtained, str) and expected.fullmatch(obtained):
+            return None
+        return f"{path}: {obtained!r} doesn't match /{expected.pattern}/"
+
+    if isinstance(expected, dict):
+        if not isinstance(obtained, dict):
+            return f"{path}: expected a dict, got {obtained!r}"
+        for key, value in expected.items():
+            if key not in obtained:
+                return f"{path}[{key!r}]: missing"
+            res = _explain(value, obtained[key], f"{path}[{key!r}]")
+            if res:
+                return res
+        return None
+
+    if isinstance(expected, list):
+        if not isinstance(obtained, list):
+            return f"{path}: expected a list, got {obtained!r}"
+        if len(obtained) != len(expected):
+            return f"{path}: expected {len(expected)} items, got {len(obtained)}"
+        for idx, (value, item) in enumerate(zip(expected, obtained)):
+            res = _explain(value, item, f"{path}[{idx}]")
+            if res:
+                return res
+        return None
+
+    if expected == obtained:
+        return None
+    return f"{path}: expected {expected!r}, got {obtained!r}"
+
+
+class Matcher:
+    """ Precompiled version of match_subdict (see compile_matcher) """
+
+    def __init__(self, expected):
+        self.expected = expected
+        self._check = _compile_check(expected)
+        self.checked = 0
+        self.matched = 0
+
+    def match(self, obtained) -> bool:
+        self.checked += 1
+        if self._check(obtained):
+            self.matched += 1
+            return True
+        return False
+
+    __call__ = match
+
+    def filter(self, batch: typing.Iterable) -> list:
+        """ Returns items of the batch (e.g. notifications) which match """
+        check = self._check
+        res = []
+        checked = 0
+        for item in batch:
+            checked += 1
+            if check(item):
+                res.append(item)
+        self.checked += checked
+        self.matched += len(res)
+        return res
+
+    def explain(self, obtained) -> typing.Optional[str]:
+        """ Describes the first difference, None when the data match (stats are not affected) """
+        return _explain(self.expected, obtained, "$")
+
+    @property
+    def match_rate(self) -> float:
+        return self.matched / self.checked if self.checked else 0.0
+
+    def stats(self) -> dict:
+        return {"checked": self.checked, "matched": self.matched, "match_rate": self.match_rate}
+
+    def __repr__(self):
+        return f"Matcher({self.expected!r}, checked={self.checked}, matched={self.matched})"
+
+
+def compile_matcher(expected) -> Matcher:
+    """ Compiles expected data into a matcher which can be applied many times
+
+        Dicts match as in match_subdict (the obtained dict may contain extra fields),
+        lists have to have the same length and their items are matched one by one,
+        ANY matches any value and a compiled regex has to match the whole string.
+        Other values are compared using ==.
+
+        :param expected: data which are expected
+        :returns: matcher (call it or use filter() for a whole batch of notifications)
+    """
+    return Matcher(expected)
+
+
 def check_service_result(name, action, passed=None, clean=True, expected_found=True):
     path = Path(INIT_SCRIPT_TEST_DIR) / name
     try:
@@ -633,12 +782,14 @@ def set_package_lists(lists=None):
 
 
 class FileFaker:
-    def __init__(self, path_prefix: typing.Union[str, Path], path: typing.Union[str, Path], executable: bool, content: str):
+    def __init__(self, path_prefix: typing.Union[str, Path], path: typing.Union[str, Path], executable: bool, content: str, latency=None):
         """ Intializes fake file
         :param path_prefix: prefixed path (e.g. /path/to/my/custom/root)
         :param path: actual file path (e.g. /usr/bin/iw)
         :param executable: should the file be executable
         :param content: the initial content of the file
+        :param latency: delay of a faked shell script (commands.LatencyProfile),
+                        the sleep is inserted right after the shebang line
         """
         # make sure that path variables are pathlib.Path
         path_prefix = Path(path_prefix)
@@ -646,6 +797,7 @@ class FileFaker:
 
         self.target_path = path_prefix / (path.relative_to("/") if path.is_absolute() else path)
         self.executable = executable
+        self.latency = latency
         self.content = content
 
     def store_file(self):
@@ -667,6 +819,12 @@ class FileFaker:
     def update_content(self, new_content):
         """ Updates the current content of the file
         """
+        if self.latency:
+            lines = new_content.split("\n")
+            position = 1 if lines[0].startswith("#!") else 0
+            lines.insert(position, self.latency.shell())
+            new_content = "\n".join(lines)
+
         with self.target_path.open("w") as f:
             f.write(new_content)
 
@@ -734,3 +892,131 @@ def prepare_turrishw(root: str):
     path = Path(__file__).resolve().parent / "turrishw" / f"{root}.tar.gz"
     with tarfile.open(path, "r:gz") as tar:
         tar.extractall(TURRISHW_ROOT)
+
+
+class CopyStats:
+    """ Accumulates the amount of data copied by copy_tree() / copy_files() """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def add(self, files: int, size: int, seconds: float):
+        with self.lock:
+            self.files += files
+            self.bytes += size
+            self.seconds += seconds
+
+    @property
+    def throughput(self) -> float:
+        """ bytes per second """
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+
+COPY_STATS = CopyStats()
+
+
+def _copy_file_content(src: str, dst: str) -> int:
+    """ Copies a single regular file using in-kernel copy when possible,
+        permission bits and timestamps are copied as well
+
+    :returns: number of bytes copied
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        src_stat = os.fstat(fsrc.fileno())
+        size = src_stat.st_size
+        copied = 0
+        try:
+            while copied < size:
+                sent = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+                if sent == 0:
+                    break
+                copied += sent
+        except (AttributeError, OSError):
+            # copy_file_range() is not available for this kernel / filesystem combination
+            try:
+                while copied < size:
+                    sent = os.sendfile(fdst.fileno(), fsrc.fileno(), copied, size - copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+            except OSError:
+                fsrc.seek(copied)
+                fdst.seek(copied)
+                shutil.copyfileobj(fsrc, fdst)
+                copied = size
+
+        os.fchmod(fdst.fileno(), stat.S_IMODE(src_stat.st_mode))
+
+    os.utime(dst, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+    return copied
+
+
+def copy_file_pairs(
+    pairs: typing.List[typing.Tuple[str, str]], workers: typing.Optional[int] = None
+) -> int:
+    """ Copies files in parallel
+
+    :param pairs: list of (source file, target file) tuples
+    :param workers: number of copying threads (COPY_WORKERS by default)
+    :returns: number of bytes copied
+    """
+    start = time.perf_counter()
+    if len(pairs) > 1 and (workers or COPY_WORKERS) > 1:
+        with ThreadPoolExecutor(max_workers=workers or COPY_WORKERS) as executor:
+            size = sum(executor.map(lambda pair: _copy_file_content(*pair), pairs))
+    else:
+        size = sum(_copy_file_content(*pair) for pair in pairs)
+
+    COPY_STATS.add(len(pairs), size, time.perf_counter() - start)
+    return size
+
+
+def copy_tree(
+    src: typing.Union[str, Path],
+    dst: typing.Union[str, Path],
+    workers: typing.Optional[int] = None,
+    symlinks: bool = False,
+) -> int:
+    """ Recursively copies a directory (similar to shutil.copytree)
+        Directories are created first and then the files are copied by a pool of threads.
+
+    :param src: source directory
+    :param dst: target directory (parent directories are created when missing)
+    :param workers: number of copying threads (COPY_WORKERS by default)
+    :param symlinks: copy symlinks as symlinks instead of the content they point to
+    :returns: number of bytes copied
+    """
+    src, dst = os.fspath(src), os.fspath(dst)
+    pairs = []
+    for root, dirs, files in os.walk(src, followlinks=not symlinks):
+        target_root = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(target_root, exist_ok=True)
+        shutil.copymode(root, target_root)
+        for name in dirs + files:
+            src_path = os.path.join(root, name)
+            if symlinks and os.path.islink(src_path):
+                os.symlink(os.readlink(src_path), os.path.join(target_root, name))
+            elif name in files:
+                pairs.append((src_path, os.path.join(target_root, name)))
+
+    return copy_file_pairs(pairs, workers)
+
+
+def copy_files(
+    paths: typing.Iterable[typing.Union[str, Path]],
+    dst_dir: typing.Union[str, Path],
+    workers: typing.Optional[int] = None,
+) -> int:
+    """ Copies files into a directory (similar to calling shutil.copy for each path)
+
+    :param paths: files to be copied
+    :param dst_dir: existing target directory
+    :param workers: number of copying threads (COPY_WORKERS by default)
+    :returns: number of bytes copied
+    """
+    dst_dir = os.fspath(dst_dir)
+    pairs = [(os.fspath(path), os.path.join(dst_dir, os.path.basename(path))) for path in paths]
+    return copy_file_pairs(pairs, workers)
@@ -0,0 +1,87 @@
+#
+# foris-controller-testtools
+# Copyright (C) 2026 CZ.NIC, z.s.p.o. (http://www.nic.cz/)
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software Foundation,
+# Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301  USA
+#
+
+import threading
+import time
+import typing
+
+
+class ValidatorCache:
+    """ ForisValidator instances keyed by (modules, extra module paths)
+
+        Creating a validator loads and compiles the JSON schemas of the modules,
+        so the validators are shared by all testtools components of the process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._validators: typing.Dict[tuple, typing.Any] = {}
+        self.hits = 0
+        self.misses = 0
+        self.compile_seconds = 0.0
+
+    def get(self, modules: typing.Iterable[str], extra_module_paths: typing.Iterable[str] = ()):
+        """ Returns a (cached) validator
+
+        :param modules: names of the modules which schemas should be loaded
+        :param extra_module_paths: paths to modules which are not installed
+        :returns: foris_schema.ForisValidator
+        """
+        key = (tuple(sorted(set(modules))), tuple(extra_module_paths))
+        with self.lock:
+            validator = self._validators.get(key)
+            if validator is not None:
+                self.hits += 1
+                return validator
+
+            from foris_controller.utils import get_validator_dirs
+            from foris_schema import ForisValidator
+
+            start = time.perf_counter()
+            validator = ForisValidator(*get_validator_dirs(list(key[0]), list(key[1])))
+            self.compile_seconds += time.perf_counter() - start
+            self.misses += 1
+            self._validators[key] = validator
+            return validator
+
+    def clear(self):
+        with self.lock:
+            self._validators = {}
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "validators": len(self._validators),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "compile_seconds": self.compile_seconds,
+        }
+
+
+VALIDATORS = ValidatorCache()
+
+
+def get_validator(modules: typing.Iterable[str], extra_module_paths: typing.Iterable[str] = ()):
+    """ Returns a validator from the process-wide cache (see ValidatorCache.get) """
+    return VALIDATORS.get(modules, extra_module_paths)